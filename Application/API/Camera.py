@@ -0,0 +1,56 @@
+class Camera:
+    """ Holds the view offset for a map. Everything on the map stays in world coordinates and the offset is only applied at blit time
+    :list offset (input): screen coordinates of the map's top left corner (float x, float y)
+    :return: None
+    """
+    def __init__(self, offset: list):
+        self.offset = offset
+
+    def to_screen(self, location):
+        ''' converts world coordinates to screen coordinates
+        :list location: world coordinates (float x, float y)
+        :return: tuple screen coordinates (float x, float y)
+        '''
+        return (location[0] + self.offset[0], location[1] + self.offset[1])
+
+    def to_world(self, point):
+        ''' converts screen coordinates (e.g. a mouse click) to world coordinates
+        :tuple point: screen coordinates (float x, float y)
+        :return: tuple world coordinates (float x, float y)
+        '''
+        return (point[0] - self.offset[0], point[1] - self.offset[1])
+
+    def center(self, dimensions: list, screen_size: tuple):
+        ''' centers the map on screen (used for static maps)
+        :list dimensions: the width and height of the map
+        :tuple screen_size: current screen size (int x, int y)
+        :return: None
+        '''
+        self.offset[0] = ((dimensions[0] // 2) - (screen_size[0] // 2)) * -1
+        self.offset[1] = ((dimensions[1] // 2) - (screen_size[1] // 2)) * -1
+
+    def follow(self, location: list, size: tuple, dimensions: list, screen_size: tuple):
+        ''' keeps a target (usually the pc) centered on screen without scrolling past the map edges. Maps smaller than the screen are centered
+        :list location: world coordinates of the target (float x, float y)
+        :tuple size: size of the target (int width, int height)
+        :list dimensions: the width and height of the map
+        :tuple screen_size: current screen size (int x, int y)
+        :return: None
+        '''
+        for i in (0, 1):
+            if dimensions[i] < screen_size[i]:
+                self.offset[i] = (screen_size[i] / 2) - (dimensions[i] / 2)
+            else:
+                target = (screen_size[i] / 2 - size[i] / 2) - location[i]
+                self.offset[i] = min(0, max(screen_size[i] - dimensions[i], target))
+
+    def is_visible(self, location: list, size: tuple, screen_size: tuple):
+        ''' checks whether anything of a world-space box would be drawn on screen
+        :list location: world coordinates of the top left corner (float x, float y)
+        :tuple size: size of the box (int width, int height)
+        :tuple screen_size: current screen size (int x, int y)
+        :return: bool visible
+        '''
+        x = location[0] + self.offset[0]
+        y = location[1] + self.offset[1]
+        return x < screen_size[0] and y < screen_size[1] and x + size[0] > 0 and y + size[1] > 0
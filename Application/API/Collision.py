@@ -0,0 +1,394 @@
+import pygame
+import os
+import hashlib
+import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PROBE_DISTANCE = 10
+SLIDE_ITERATIONS = 2
+CONTACT_SKIN = 0.01
+NO_HIT = (1.0, None, None)
+
+def axis_times(start: float, length: float, velocity: float, low: float, high: float):
+    ''' times along a move at which a moving interval starts and stops overlapping a fixed one (touching doesn't count as overlapping)
+    :return: tuple (float entry, float exit), or None if a motionless interval never overlaps
+    '''
+    if velocity > 0:
+        return (low - (start + length)) / velocity, (high - start) / velocity
+    if velocity < 0:
+        return (high - start) / velocity, (low - (start + length)) / velocity
+    if start + length <= low or start >= high:
+        return None
+    return float('-inf'), float('inf')
+
+def penetration(location: list, size: tuple, velocity: tuple, blocker, entries: tuple):
+    ''' the way out of a blocker a rect already overlaps, if it is moving deeper into it. The rect is pushed back along whichever
+    axis of its velocity is the shortest way out, never across it
+    :list location: world coordinates of the top left corner (float x, float y)
+    :tuple size: width and height of the rect
+    :tuple velocity: movement this step (float x, float y)
+    :obj blocker: anything with a location and size
+    :tuple entries: entry time along each axis (negative for an overlap)
+    :return: tuple (float negative time back to the contact, int axis) or None if the rect is moving out
+    '''
+    best = None
+    for axis in (0, 1):
+        if velocity[axis] == 0:
+            continue
+        towards = blocker.location[axis] + blocker.size[axis] / 2 - (location[axis] + size[axis] / 2)
+        if towards * velocity[axis] < 0:
+            continue
+        if best is None or abs(velocity[axis] * entries[axis]) < abs(velocity[best[1]] * best[0]):
+            best = (entries[axis], axis)
+    return best
+
+def sweep_aabb(location: list, size: tuple, velocity: tuple, blocker):
+    ''' swept AABB test of a moving rect against one blocker. A blocker the rect already overlaps only counts if the rect is moving deeper into it
+    :list location: world coordinates of the top left corner (float x, float y)
+    :tuple size: width and height of the rect
+    :tuple velocity: movement this step (float x, float y)
+    :obj blocker: anything with a location and size
+    :return: tuple (float time of impact up to 1, negative to back out of an overlap, int axis of the contact normal) or None
+    '''
+    x = axis_times(location[0], size[0], velocity[0], blocker.location[0], blocker.location[0] + blocker.size[0])
+    if x is None:
+        return None
+    y = axis_times(location[1], size[1], velocity[1], blocker.location[1], blocker.location[1] + blocker.size[1])
+    if y is None:
+        return None
+    entry = max(x[0], y[0])
+    exit = min(x[1], y[1])
+    if entry > 1 or entry >= exit or exit <= 0:
+        return None
+    if entry < 0:
+        return penetration(location, size, velocity, blocker, (x[0], y[0]))
+    return entry, 0 if x[0] >= y[0] else 1
+
+def sweep(location: list, size: tuple, velocity: tuple, blockers: list, static=None):
+    ''' finds the first blocker a moving rect would hit. The earliest hit wins (overlaps being backed out of come first), ties go to the static backend and then to list order
+    :list location: world coordinates of the top left corner (float x, float y)
+    :tuple size: width and height of the rect
+    :tuple velocity: movement this step (float x, float y)
+    :list blockers: candidate blockers (e.g. from Map.get_blockers over the swept rect)
+    :obj static: BlockerArrays or CollisionMask of the map's static blockers (optional: default None)
+    :return: tuple (float time of impact, int normal axis or None, blocker hit or None)
+    '''
+    best = static.sweep(location, size, velocity) if static is not None else NO_HIT
+    for b in blockers:
+        hit = sweep_aabb(location, size, velocity, b)
+        if hit and hit[0] < best[0]:
+            best = (hit[0], hit[1], b)
+    return best
+
+def move_and_slide(location: list, size: tuple, velocity: tuple, blockers: list, static=None, iterations: int = SLIDE_ITERATIONS):
+    ''' moves a rect along its full velocity, stopping CONTACT_SKIN short of the first contact and sliding the rest of the move along the contact surface.
+    A rect moving deeper into something it already overlaps is pushed back out along that axis. Costs at most one sweep per iteration whatever the speed
+    :list location: world coordinates of the top left corner (float x, float y)
+    :tuple size: width and height of the rect
+    :tuple velocity: movement this step (float x, float y)
+    :list blockers: candidate blockers covering the swept rect
+    :obj static: BlockerArrays or CollisionMask of the map's static blockers (optional: default None)
+    :int iterations: maximum number of slides (optional: default SLIDE_ITERATIONS)
+    :return: tuple (list new location, list of everything hit: blockers, or True for a collision mask wall)
+    '''
+    location = [location[0], location[1]]
+    remaining = [velocity[0], velocity[1]]
+    hits = []
+    for _ in range(iterations):
+        if remaining[0] == 0 and remaining[1] == 0:
+            break
+        toi, axis, hit = sweep(location, size, remaining, blockers, static)
+        if hit is None:
+            location[0] += remaining[0]
+            location[1] += remaining[1]
+            break
+        hits.append(hit)
+        travel = max(toi, 0.0)
+        location[0] += remaining[0] * travel
+        location[1] += remaining[1] * travel
+        location[axis] += remaining[axis] * (toi - travel) - math.copysign(CONTACT_SKIN, remaining[axis])
+        remaining = [remaining[0] * (1 - travel), remaining[1] * (1 - travel)]
+        remaining[axis] = 0
+    return location, hits
+
+class BlockerArrays:
+    """ Structure-of-arrays copy of a map's static blockers, so a sweep runs as one vectorized test per query.
+    Needs numpy; use BlockerArrays.available() before building one
+    :list blockers (input): static blockers (e.g. Map.Block) with a location and size
+    :array x: left edges
+    :array y: top edges
+    :array w: widths
+    :array h: heights
+    """
+    def __init__(self, blockers: list):
+        self.blockers = list(blockers)
+        self.x = numpy.array([b.location[0] for b in self.blockers], dtype=numpy.float64)
+        self.y = numpy.array([b.location[1] for b in self.blockers], dtype=numpy.float64)
+        self.w = numpy.array([b.size[0] for b in self.blockers], dtype=numpy.float64)
+        self.h = numpy.array([b.size[1] for b in self.blockers], dtype=numpy.float64)
+
+    def __len__(self):
+        return len(self.blockers)
+
+    @staticmethod
+    def available():
+        return numpy is not None
+
+    def axis_times(self, start: float, length: float, velocity: float, low, high):
+        ''' vectorized Collision.axis_times against every blocker
+        :return: tuple (array entry, array exit), infinite where a motionless interval overlaps and nan where it never does
+        '''
+        if velocity > 0:
+            return (low - (start + length)) / velocity, (high - start) / velocity
+        if velocity < 0:
+            return (high - start) / velocity, (low - (start + length)) / velocity
+        overlap = (start + length > low) & (start < high)
+        return numpy.where(overlap, -numpy.inf, numpy.nan), numpy.where(overlap, numpy.inf, numpy.nan)
+
+    def sweep(self, location: list, size: tuple, velocity: tuple):
+        ''' vectorized Collision.sweep against every blocker at once, backing out of overlaps the rect is moving deeper into like Collision.penetration
+        :list location: world coordinates of the top left corner (float x, float y)
+        :tuple size: width and height of the rect
+        :tuple velocity: movement this step (float x, float y)
+        :return: tuple (float time of impact, int normal axis or None, blocker hit or None)
+        '''
+        if not self.blockers:
+            return NO_HIT
+        x_entry, x_exit = self.axis_times(location[0], size[0], velocity[0], self.x, self.x + self.w)
+        y_entry, y_exit = self.axis_times(location[1], size[1], velocity[1], self.y, self.y + self.h)
+        with numpy.errstate(invalid='ignore'):
+            entry = numpy.maximum(x_entry, y_entry)
+            valid = (entry <= 1) & (entry < numpy.minimum(x_exit, y_exit)) & (numpy.minimum(x_exit, y_exit) > 0)
+            axis = numpy.where(x_entry >= y_entry, 0, 1)
+            inside = valid & (entry < 0)
+            if inside.any():
+                deeper_x = (velocity[0] != 0) & ((self.x + self.w / 2 - location[0] - size[0] / 2) * velocity[0] >= 0)
+                deeper_y = (velocity[1] != 0) & ((self.y + self.h / 2 - location[1] - size[1] / 2) * velocity[1] >= 0)
+                push_x = numpy.where(deeper_x, numpy.abs(velocity[0] * x_entry), numpy.inf)
+                push_y = numpy.where(deeper_y, numpy.abs(velocity[1] * y_entry), numpy.inf)
+                axis = numpy.where(inside, numpy.where(push_x <= push_y, 0, 1), axis)
+                entry = numpy.where(inside, numpy.where(push_x <= push_y, x_entry, y_entry), entry)
+                valid &= ~inside | deeper_x | deeper_y
+        if not valid.any():
+            return NO_HIT
+        index = int(numpy.argmin(numpy.where(valid, entry, numpy.inf)))
+        return float(entry[index]), int(axis[index]), self.blockers[index]
+
+def collision_image_path(path: str):
+    """ the optional companion collision image for a map image (e.g. Resources/map_collision.png for Resources/map.png)
+    :str path: filepath to the map image
+    :return: str filepath
+    """
+    root, ext = os.path.splitext(path)
+    return f'{root}_collision{ext}'
+
+class CollisionMask:
+    """ Precompiled per-pixel collision mask of a map: its blocks, plus every opaque pixel of its companion collision image if it has one.
+    Compiled masks are cached on disk under a hash of the block rows, so editing a map's Blocks rebuilds its mask
+    :list blockers (input): static blockers (e.g. Map.Block) with a location and size
+    :tuple dimensions (input): the width and height of the map
+    :str image_path (input): filepath to the map image, used to find the companion collision image
+    :str cache_dir (input): directory for compiled masks
+    :str name (input): cache file prefix unique to the map, stale masks with the same prefix are deleted
+    :str key: hash of everything the mask is built from
+    :obj mask: pygame Mask, a set bit is a wall
+    :bool from_cache: whether the mask was read from the disk cache
+    """
+    def __init__(self, blockers: list, dimensions: tuple, image_path: str, cache_dir: str, name: str):
+        self.blockers = list(blockers)
+        self.dimensions = (int(dimensions[0]), int(dimensions[1]))
+        self.image_path = image_path
+        self.cache_dir = cache_dir
+        self.name = name
+        self.key = self.get_key()
+        self.from_cache = False
+        self.mask = self.load()
+
+    def get_key(self):
+        ''' hashes the map size, block rows and companion image so stale masks are never reused
+        :return: str hex digest
+        '''
+        source = [self.dimensions] + [(b.id, tuple(b.location), tuple(b.size)) for b in self.blockers]
+        companion = collision_image_path(self.image_path)
+        if os.path.exists(companion):
+            source.append((os.path.getmtime(companion), os.path.getsize(companion)))
+        return hashlib.sha1(repr(source).encode()).hexdigest()[:16]
+
+    def cache_path(self):
+        return os.path.join(self.cache_dir, f'{self.name}_{self.key}.png')
+
+    def load(self):
+        ''' reads the compiled mask from the disk cache, compiling and caching it if it is missing or stale
+        :return: pygame Mask
+        '''
+        path = self.cache_path()
+        if os.path.exists(path):
+            cached = pygame.mask.from_surface(pygame.image.load(path))
+            if cached.get_size() == self.dimensions:
+                self.from_cache = True
+                return cached
+        mask = self.compile()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for f in os.listdir(self.cache_dir):
+            if f.startswith(f'{self.name}_') and len(f) == len(self.name) + 21:
+                os.remove(os.path.join(self.cache_dir, f))
+        pygame.image.save(mask.to_surface(setcolor=(255, 255, 255, 255), unsetcolor=(0, 0, 0, 0)), path)
+        return mask
+
+    def compile(self):
+        ''' rasterizes the blocks and the companion collision image into one mask
+        :return: pygame Mask
+        '''
+        companion = collision_image_path(self.image_path)
+        if os.path.exists(companion):
+            image_mask = pygame.mask.from_surface(pygame.image.load(companion))
+            mask = pygame.mask.Mask(self.dimensions)
+            mask.draw(image_mask, (0, 0))
+        else:
+            mask = pygame.mask.Mask(self.dimensions)
+        for b in self.blockers:
+            size = (int(b.size[0]), int(b.size[1]))
+            if size[0] > 0 and size[1] > 0:
+                mask.draw(pygame.mask.Mask(size, fill=True), (int(b.location[0]), int(b.location[1])))
+        return mask
+
+    def is_wall(self, point: tuple):
+        ''' O(1) lookup of a single pixel. Anything outside the map counts as a wall
+        :tuple point: world coordinates (x, y)
+        :return: bool
+        '''
+        x, y = int(point[0]), int(point[1])
+        if not (0 <= x < self.dimensions[0] and 0 <= y < self.dimensions[1]):
+            return True
+        return bool(self.mask.get_at((x, y)))
+
+    def is_walkable(self, location: list, size: tuple):
+        ''' whether a rect touches no wall
+        :list location: world coordinates of the top left corner (float x, float y)
+        :tuple size: width and height of the rect
+        :return: bool
+        '''
+        return not self.overlaps(int(location[0]), int(location[1]), int(size[0]), int(size[1]))
+
+    def overlaps(self, x: int, y: int, w: int, h: int):
+        if w <= 0 or h <= 0:
+            return False
+        return self.mask.overlap(pygame.mask.Mask((w, h), fill=True), (x, y)) is not None
+
+    def probe_rect(self, location: list, size: tuple, pos_index: int, add_dimensions: bool, distance: int):
+        ''' the strip of a given depth directly in front of a rect, as wide as the rect
+        :return: tuple (x, y, w, h)
+        '''
+        range_index = 1 - pos_index
+        start = [0, 0]
+        length = [0, 0]
+        start[range_index] = int(location[range_index])
+        length[range_index] = int(size[range_index])
+        if add_dimensions:
+            start[pos_index] = int(location[pos_index]) - distance
+        else:
+            start[pos_index] = int(location[pos_index] + size[pos_index])
+        length[pos_index] = distance
+        return start[0], start[1], length[0], length[1]
+
+    def wall_distance(self, location: list, size: tuple, pos_index: int, add_dimensions: bool, limit: int = PROBE_DISTANCE):
+        ''' free pixels between a rect and the nearest wall in front of it, found with a binary search of mask overlaps
+        :list location: world coordinates of the top left corner (float x, float y)
+        :tuple size: width and height of the rect
+        :int pos_index: the axis the rect is moving along (x or y)
+        :bool add_dimensions: whether the rect is moving towards lower coordinates (i.e. N or W)
+        :int limit: furthest distance to look (optional: default PROBE_DISTANCE)
+        :return: int distance, or None if there is no wall within the limit
+        '''
+        if not self.overlaps(*self.probe_rect(location, size, pos_index, add_dimensions, limit)):
+            return None
+        low, high = 0, limit
+        while low + 1 < high:
+            mid = (low + high) // 2
+            if self.overlaps(*self.probe_rect(location, size, pos_index, add_dimensions, mid)):
+                high = mid
+            else:
+                low = mid
+        return low
+
+    def overlap_area(self, x: int, y: int, w: int, h: int):
+        if w <= 0 or h <= 0:
+            return 0
+        return self.mask.overlap_area(pygame.mask.Mask((w, h), fill=True), (x, y))
+
+    def sweep(self, location: list, size: tuple, velocity: tuple):
+        ''' mask version of Collision.sweep. Each axis of the move is searched on its own (a binary search of the strip in front of the rect),
+        then the whole move is checked so a diagonal that only clips a wall's corner still stops at it. Times of impact land the rect halfway into
+        the pixel next to the wall once move_and_slide has taken off its CONTACT_SKIN, so rounding never tips it into the wall
+        :list location: world coordinates of the top left corner (float x, float y)
+        :tuple size: width and height of the rect
+        :tuple velocity: movement this step (float x, float y)
+        :return: tuple (float time of impact, int normal axis or None, True if a wall was hit or None)
+        '''
+        x, y, w, h = int(location[0]), int(location[1]), int(size[0]), int(size[1])
+        if self.overlaps(x, y, w, h):
+            return self.penetration(location, size, velocity)
+        best = NO_HIT
+        for axis in (0, 1):
+            if velocity[axis] == 0:
+                continue
+            distance = self.wall_distance(location, size, axis, velocity[axis] < 0, int(abs(velocity[axis])) + 1)
+            if distance is not None:
+                sign = 1 if velocity[axis] > 0 else -1
+                target = int(location[axis]) + sign * distance + 0.5
+                toi = (sign * (target - location[axis]) + CONTACT_SKIN) / abs(velocity[axis])
+                if toi < best[0]:
+                    best = (toi, axis, True)
+        if velocity[0] != 0 and velocity[1] != 0:
+            return self.corner(location, size, velocity, best)
+        return best
+
+    def corner(self, location: list, size: tuple, velocity: tuple, best: tuple):
+        ''' bisects a diagonal move that is clear along each axis on its own for the last point before it clips a wall's corner
+        :tuple best: the earliest hit found along either axis on its own, NO_HIT if none
+        :return: tuple (float time of impact, int normal axis, True), or best if the move is clear up to it
+        '''
+        w, h = int(size[0]), int(size[1])
+        low, high = 0.0, min(best[0], 1.0)
+        if not self.overlaps(int(location[0] + velocity[0] * high), int(location[1] + velocity[1] * high), w, h):
+            return best
+        for _ in range(8):
+            mid = (low + high) / 2
+            if self.overlaps(int(location[0] + velocity[0] * mid), int(location[1] + velocity[1] * mid), w, h):
+                high = mid
+            else:
+                low = mid
+        if self.overlaps(int(location[0] + velocity[0] * high), int(location[1] + velocity[1] * low), w, h):
+            return low, 0, True
+        if self.overlaps(int(location[0] + velocity[0] * low), int(location[1] + velocity[1] * high), w, h):
+            return low, 1, True
+        return low, 0 if abs(velocity[0]) < abs(velocity[1]) else 1, True
+
+    def penetration(self, location: list, size: tuple, velocity: tuple):
+        ''' mask version of Collision.penetration: if a step along an axis of the velocity would overlap more wall, the rect is backed out
+        against that axis to the nearest clear pixel (up to its own size), or held still if there is none
+        :return: tuple (float negative time back to clear, int axis, True), or NO_HIT if the rect is moving out of the wall
+        '''
+        x, y, w, h = int(location[0]), int(location[1]), int(size[0]), int(size[1])
+        depth = self.overlap_area(x, y, w, h)
+        best = NO_HIT
+        for axis in (0, 1):
+            if velocity[axis] == 0:
+                continue
+            sign = 1 if velocity[axis] > 0 else -1
+            moved = [x, y]
+            moved[axis] += sign
+            if self.overlap_area(moved[0], moved[1], w, h) <= depth:
+                continue
+            toi = 0.0
+            for d in range(1, int(size[axis]) + 1):
+                moved[axis] = (x, y)[axis] - sign * d
+                if not self.overlaps(moved[0], moved[1], w, h):
+                    toi = -d / abs(velocity[axis])
+                    break
+            if best[2] is None or abs(velocity[axis] * toi) < abs(velocity[best[1]] * best[0]):
+                best = (toi, axis, True)
+        return best
@@ -1,9 +1,8 @@
-import pygame
 import random
 import os
-from . import Map, Item
+from . import Collision, Item, Persistence, SpriteCache
 
-class Creature:
+class Creature(Persistence.Persisted):
     """ Parent class for all NPCs and monsters, as well as the main character.
     :str directory: filepath to the main game folder
     :list location: current location (int x, int y)
@@ -33,20 +32,14 @@ class Creature:
 
     def load_images(self, actions):
         image_dict = {
-            'default': pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}default.png')).convert_alpha(),
-            'W': [pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}w1.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}w2.png')).convert_alpha(),
-            pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}w3.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}w2.png')).convert_alpha()],
-            'E': [pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}e1.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}e2.png')).convert_alpha(),
-            pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}e3.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}e2.png')).convert_alpha()],
-            'N': [pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}n1.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}n2.png')).convert_alpha(),
-            pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}n3.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}n2.png')).convert_alpha()],
-            'S': [pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}s1.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}s2.png')).convert_alpha(),
-            pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}s3.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}s2.png')).convert_alpha()]
+            'default': SpriteCache.sprites.load(os.path.join(self.directory, f'Resources/{self.name}default.png')),
+            'W': SpriteCache.sprites.load_frames(self.directory, f'{self.name}w'),
+            'E': SpriteCache.sprites.load_frames(self.directory, f'{self.name}e'),
+            'N': SpriteCache.sprites.load_frames(self.directory, f'{self.name}n'),
+            'S': SpriteCache.sprites.load_frames(self.directory, f'{self.name}s')
         }
         for a in actions:
-            print(a)
-            image_dict[a] = [pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}{a}1.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}{a}2.png')).convert_alpha(),
-            pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}{a}3.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}{a}2.png')).convert_alpha()]
+            image_dict[a] = SpriteCache.sprites.load_frames(self.directory, f'{self.name}{a}')
         return image_dict
 
     def move(self, direction: str, ismoving: bool):
@@ -91,74 +84,177 @@ class Creature:
 class NPC(Creature):
     """ Sub class for all NPCs
     :list bounds: box bounds of creature movement on map (int xmin, int xmax, int ymin, int ymax)
-    :list move_range: the count at which the NPC starts to move, and the count at which the NPC starts their action
+    :list move_range: the tick of the movement cycle at which the NPC starts to move, and the tick at which the NPC starts their action (simulation ticks, not frames)
     :bool wants_to_talk: whether the creature has something to say to PC (red ! if so?)
     :bool is_talking: whether the creature is interacting
+    :obj path: Pathfinding.PathRequest the NPC is walking instead of wandering, or None
+    :int waypoint: index of the next waypoint of the path. Requests are shared between NPCs asking for the same path, so each keeps its own cursor
+    :list goal: the exact point the path leads to, walked to after the last waypoint (waypoints are nav cell corners), or None
     """
+    table = 'NPCs'
+    persisted = {'map_id': 'MapID', 'location': Persistence.LOCATION, 'speed': 'Speed', 'inventory': None}
+
     def __init__(self, path: str, id: int, map_id: int, location: list, size: tuple, speed: int, name: str, actions: list, bounds: list, move_range: list, wants_to_talk: bool):
         super().__init__(path, id, map_id, location, size, speed, name, actions)
         self.bounds = bounds
         self.move_range = move_range
         self.wants_to_talk = wants_to_talk
         self.inventory = []
+        self.path = None
+        self.waypoint = 0
+        self.goal = None
 
-    def action(self, fps, count, index_rate, pc):
+    def action(self, fps, count, index_rate, pc, animate: bool = True, map=None):
+        """ runs the NPC's wander/action cycle for one simulation tick
+        :int fps: simulation ticks per second
+        :int count: simulation ticks elapsed in the NPC movement cycle
+        :int index_rate: the rate of sprite image swapping
+        :obj pc: main character
+        :bool animate: whether to update the sprite (False while the NPC is culled off-screen)(optional: default True)
+        :obj map: the map the NPC is on. Moves are swept against its blockers and the pc (optional: default None, moves are unobstructed)
+        :return: None
+        """
         if not self.is_talking:
-            if count == self.move_range[0]:
-                str_directions = []
-                max_distance = self.speed * fps * (abs(self.move_range[1] - self.move_range[0]) / fps)
-                if self.location[0] > self.bounds[0] + max_distance:
-                    str_directions.append('W')
-                if self.location[0] < self.bounds[1] - max_distance:
-                    str_directions.append('E')
-                if self.location[1] > self.bounds[2] + max_distance:
-                    str_directions.append('N')
-                if self.location[1] < self.bounds[3] - max_distance:
-                    str_directions.append('S')
-                if len(str_directions) > 0:
-                    index = random.randint(0, len(str_directions) - 1)
-                    direction = str_directions[index]
-                    if direction == 'W':
-                        self.moveleft = True
-                    elif direction == 'E':
-                        self.moveright = True
-                    elif direction == 'N':
-                        self.moveup = True
-                    elif direction == 'S':
-                        self.movedown = True
+            if self.path is not None:
+                direction = self.follow_path(pc, map)
+            if self.path is None:
+                if count == self.move_range[0]:
+                    str_directions = []
+                    max_distance = self.speed * fps * (abs(self.move_range[1] - self.move_range[0]) / fps)
+                    if self.location[0] > self.bounds[0] + max_distance:
+                        str_directions.append('W')
+                    if self.location[0] < self.bounds[1] - max_distance:
+                        str_directions.append('E')
+                    if self.location[1] > self.bounds[2] + max_distance:
+                        str_directions.append('N')
+                    if self.location[1] < self.bounds[3] - max_distance:
+                        str_directions.append('S')
+                    if len(str_directions) > 0:
+                        index = random.randint(0, len(str_directions) - 1)
+                        direction = str_directions[index]
+                        if direction == 'W':
+                            self.moveleft = True
+                        elif direction == 'E':
+                            self.moveright = True
+                        elif direction == 'N':
+                            self.moveup = True
+                        elif direction == 'S':
+                            self.movedown = True
+                    else:
+                        direction = 'action'
+                elif self.move_range[0] < count <= self.move_range[1]:
+                    if self.moveup:
+                        self.step((0, 0 - self.speed), pc, map)
+                        direction = 'N'
+                    elif self.movedown:
+                        self.step((0, self.speed), pc, map)
+                        direction = 'S'
+                    elif self.moveleft:
+                        self.step((0 - self.speed, 0), pc, map)
+                        direction = 'W'
+                    elif self.moveright:
+                        self.step((self.speed, 0), pc, map)
+                        direction = 'E'
+                    else:
+                        direction = 'action'
                 else:
                     direction = 'action'
-            elif self.move_range[0] < count <= self.move_range[1]:
-                if self.moveup:
-                    if abs(self.location[1] - pc.location[1] - pc.size[1]) > 2:
-                        self.location[1] -= self.speed
-                    direction = 'N'
-                elif self.movedown:
-                    if abs(self.location[1] + self.size[1] - pc.location[1]) > 2:
-                        self.location[1] += self.speed
-                    direction = 'S'
-                elif self.moveleft:
-                    if abs(self.location[0] - pc.location[0] - pc.size[0]) > 2:
-                        self.location[0] -= self.speed
-                    direction = 'W'
-                elif self.moveright:
-                    if abs(self.location[0] + self.size[0] - pc.location[0]) > 2:
-                        self.location[0] += self.speed
-                    direction = 'E'
-                else:
-                    direction = 'action'
-            else:
-                direction = 'action'
-                self.moveup = False
-                self.movedown = False
-                self.moveright = False
-                self.moveleft = False
-            self.icon_index += 1
-            if self.icon_index // index_rate == len(self.icons['E']):
-                self.icon_index = 0
-            self.icon = self.icons[direction][self.icon_index // index_rate]
+                    self.moveup = False
+                    self.movedown = False
+                    self.moveright = False
+                    self.moveleft = False
+            if animate:
+                self.icon_index += 1
+                if self.icon_index // index_rate == len(self.icons['E']):
+                    self.icon_index = 0
+                self.icon = self.icons[direction][self.icon_index // index_rate]
             
 
+    def in_bounds(self):
+        return self.bounds[0] <= self.location[0] <= self.bounds[1] and self.bounds[2] <= self.location[1] <= self.bounds[3]
+
+    def home(self):
+        """ the nearest point inside the NPC's wander bounds
+        :return: list world coordinates for its top left corner (float x, float y)
+        """
+        return [min(max(self.location[0], self.bounds[0]), self.bounds[1]), min(max(self.location[1], self.bounds[2]), self.bounds[3])]
+
+    def walk_to(self, pathfinder, map, goal: list):
+        """ asks the pathfinder for a path to a point. The NPC stops wandering and follows it once it is found
+        :obj pathfinder: Pathfinding.Pathfinder
+        :obj map: the map the NPC is on
+        :list goal: where the NPC's top left corner should end up (float x, float y)
+        :return: obj Pathfinding.PathRequest
+        """
+        self.path = pathfinder.request(map, self.location, goal, self.size)
+        self.waypoint = 0
+        self.goal = [goal[0], goal[1]]
+        self.moveup = self.movedown = self.moveleft = self.moveright = False
+        return self.path
+
+    def next_waypoint(self):
+        """ the point the NPC is walking to: the path's waypoints in turn, then the goal itself
+        :return: list world coordinates (float x, float y), or None once the goal is reached
+        """
+        waypoints = self.path.waypoints
+        if self.waypoint < len(waypoints):
+            return waypoints[self.waypoint]
+        return self.goal if self.waypoint == len(waypoints) else None
+
+    def follow_path(self, pc, map):
+        """ walks towards the next waypoint of the current path, one axis at a time, and finishes on the exact goal. The shared waypoints are only read.
+        An NPC that is blocked outright gives the path up (strays are sent home again next cycle)
+        :obj pc: main character
+        :obj map: the map the NPC is on
+        :return: str direction the NPC is facing
+        """
+        if self.path.status == 'pending':
+            return 'action'
+        if self.path.status == 'failed' or not self.path.waypoints:
+            self.path = None
+            return 'action'
+        target = self.next_waypoint()
+        dx = target[0] - self.location[0]
+        dy = target[1] - self.location[1]
+        moving = abs(dx) > self.speed or abs(dy) > self.speed
+        if not moving:
+            self.location = [target[0], target[1]]
+            self.waypoint += 1
+            target = self.next_waypoint()
+            if target is None:
+                self.path = None
+                return 'action'
+            dx = target[0] - self.location[0]
+            dy = target[1] - self.location[1]
+        if abs(dx) > abs(dy):
+            velocity = (self.speed if dx > 0 else 0 - self.speed, 0)
+            direction = 'E' if dx > 0 else 'W'
+        else:
+            velocity = (0, self.speed if dy > 0 else 0 - self.speed)
+            direction = 'S' if dy > 0 else 'N'
+        if moving:
+            before = (self.location[0], self.location[1])
+            self.step(velocity, pc, map)
+            if (self.location[0], self.location[1]) == before:
+                self.path = None
+        return direction
+
+    def step(self, velocity: tuple, pc, map):
+        """ sweeps the NPC along a velocity with the same resolver as the pc, stopping at (and sliding along) blockers, and the creatures and pc the map's broadphase paired it with
+        :tuple velocity: movement this frame (float x, float y)
+        :obj pc: main character, or None
+        :obj map: the map the NPC is on, or None to move unobstructed
+        :return: None
+        """
+        if map is None:
+            self.location = [self.location[0] + velocity[0], self.location[1] + velocity[1]]
+            return
+        blockers = map.get_movement_blockers(self, velocity)
+        if pc is not None and pc not in map.broadphase.neighbours:
+            blockers.append(pc)
+        self.location = Collision.move_and_slide(self.location, self.size, velocity, blockers, map.static)[0]
+
+
 class MainPC(Creature):
     """ Sub class for the main character
     :str direction: player's current direction
@@ -184,6 +280,13 @@ class MainPC(Creature):
     :list inventory: list of integer ids for items in player inventory
     :return: None
     """
+    table = 'PC'
+    persisted = {'size': Persistence.SIZE, 'speed': 'Speed', 'name': 'Name', 'strength': 'Strength', 'accuracy': 'Accuracy', 'intelligence': 'Intelligence',
+                    'dexterity': 'Dexterity', 'currHP': 'CurrHP', 'maxHP': 'MaxHP', 'melee': 'Melee', 'ranged': 'Ranged', 'magic': 'Magic',
+                    'farming': 'Farming', 'trading': 'Trading', 'fishing': 'Fishing', 'handling': 'Handling', 'alchemy': 'Alchemy',
+                    'head_equip': 'HeadEquip', 'body_equip': 'BodyEquip', 'melee_equip': 'MeleeEquip', 'ranged_equip': 'RangedEquip',
+                    'spell_equip': 'SpellEquip', 'inventory': None}
+
     def __init__(self, path, id, map_id, location, size, speed, name, actions, strength: int, accuracy: int, intelligence: int, dexterity: int, currHP: int, maxHP: int, melee: int, ranged: int,
                     magic: int, farming: int, trading: int, fishing: int, handling: int, alchemy: int, head_equip: int, body_equip: int, melee_equip: int,
                     ranged_equip: int, spell_equip: int, inventory: list):
@@ -235,35 +338,6 @@ class MainPC(Creature):
                 else:
                     thing.is_talking = False
 
-    def check_surroundings(self, blockers: list, pos_index: int, range_index: int, add_dimensions: bool):
-        ''' Checks surroundings for blockers or items
-        :list blockers: all blockers currently on map
-        :int pos_index: the axis to be checked for blockers (x or y)
-        :int range_index: the axis to be checked to indicate whether pc is in the range of a blocker (x or y)
-        :bool add_dimensions: whether the size along an axis is to be added to its coordinate (i.e. if approached from the south or east)
-        :return: None        
-        '''
-        for b in blockers:
-            is_collision = False
-            if b.size[range_index] > self.size[range_index]:
-                if b.location[range_index] < self.location[range_index] < b.location[range_index] + b.size[range_index] or b.location[range_index] < self.location[range_index] + self.size[range_index] < b.location[range_index] + b.size[range_index]:
-                    is_collision = True
-            else:
-                if self.location[range_index] < b.location[range_index] < self.location[range_index] + self.size[range_index] or self.location[range_index] < b.location[range_index] + b.size[range_index] < self.location[range_index] + self.size[range_index]:
-                    is_collision = True
-            if is_collision:
-                if add_dimensions:
-                    curr_pos = self.location[pos_index]
-                    wall = b.location[pos_index] + b.size[pos_index]
-                else:
-                    curr_pos = self.location[pos_index] + self.size[pos_index]
-                    wall = b.location[pos_index]
-                if abs(curr_pos - wall) < 10:
-                    return b
-        return False
-
-
-
     def inspect(self, id: int):
         """ Opens an inspection dialog box with item id.
         :int id: id of item being inspected
@@ -335,10 +409,13 @@ class Monster(NPC):
     :list inventory: inventory for monster
     :return: None
     """
-    def __init__(self, path, id, map_id, location, size, speed, name, actions, wantstotalk, strength: int, accuracy: int, intelligence: int, dexterity: int, currHP: int, maxHP: int, melee: int, ranged: int,
-                    magic: int, head_equip: int, body_equip: int, melee_equip: int,
+    table = 'Monsters'
+    persisted = dict(NPC.persisted, head_equip='HeadEquip', body_equip='BodyEquip', melee_equip='MeleeEquip', ranged_equip='RangedEquip', spell_equip='SpellEquip')
+
+    def __init__(self, path, id, map_id, location, size, speed, name, actions, bounds: list, move_range: list, wants_to_talk: bool, strength: int, accuracy: int, intelligence: int, dexterity: int,
+                    currHP: int, maxHP: int, melee: int, ranged: int, magic: int, head_equip: int, body_equip: int, melee_equip: int,
                     ranged_equip: int, spell_equip: int, difficulty_rating: int, inventory: list):
-        super().__init__(path, id, map_id, location, size, speed, name, actions, wantstotalk)
+        super().__init__(path, id, map_id, location, size, speed, name, actions, bounds, move_range, wants_to_talk)
         self.strength = strength
         self.accuracy = accuracy
         self.intelligence = intelligence
@@ -1,7 +1,22 @@
+import re
 import sqlite3
+from collections import namedtuple
+from contextlib import contextmanager
+
+STATEMENT_CACHE_SIZE = 256
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
 
 class DBManager:
+    """ Query layer over the game's SQLite database. Every query binds its values as parameters, so SQLite reuses one prepared plan per statement
+    :str file (input): database filepath
+    :dict columns: column names of each table, read once from PRAGMA table_info
+    :dict statements: SQL text of each statement built so far, keyed by (operation, table, fields)
+    :dict row_types: namedtuple row type of each column layout. Rows can still be indexed like plain tuples
+    """
     def __init__(self, file):
+        self.columns = {}
+        self.statements = {}
+        self.row_types = {}
         self.conn = self.create_connection(file)
 
     def create_connection(self, db_file):
@@ -12,13 +27,69 @@ class DBManager:
         """
         conn = None
         try:
-            conn = sqlite3.connect(db_file)
+            conn = sqlite3.connect(db_file, cached_statements=STATEMENT_CACHE_SIZE)
+            conn.row_factory = self.make_row
             return conn
         except Exception as e:
             print(e)
 
         return conn
 
+    def make_row(self, cursor, row):
+        """ row factory: wraps each fetched row in a namedtuple named after the query's columns
+        :obj cursor: cursor the row was fetched with
+        :tuple row: column values
+        :return: namedtuple row
+        """
+        fields = tuple(d[0] for d in cursor.description)
+        row_type = self.row_types.get(fields)
+        if row_type is None:
+            row_type = namedtuple('Row', fields, rename=True)
+            self.row_types[fields] = row_type
+        return row_type._make(row)
+
+    def check_identifier(self, name):
+        """ guards table and column names, which can't be bound as parameters
+        :string name: identifier
+        :return: string name
+        """
+        if not isinstance(name, str) or not IDENTIFIER.match(name):
+            raise ValueError(f'invalid identifier: {name!r}')
+        return name
+
+    def check_table(self, table):
+        """ guards a table name against the database schema
+        :string table: table name
+        :return: string table name
+        """
+        if table not in self.columns:
+            self.get_colnames(self.check_identifier(table))
+        if not self.columns[table]:
+            raise ValueError(f'no such table: {table}')
+        return table
+
+    def check_field(self, table, field):
+        """ guards a column name against a table's columns
+        :string table: table name
+        :string field: column name
+        :return: string column name
+        """
+        if field.lower() not in (c.lower() for c in self.get_colnames(table)):
+            raise ValueError(f'no such column: {table}.{field}')
+        return field
+
+    def statement(self, key, build):
+        """ get the SQL text of a statement, building it on first use
+        :tuple key: (operation, table, fields)
+        :function build: returns the SQL text
+        :return: string SQL
+        """
+        sql = self.statements.get(key)
+        if sql is None:
+            sql = build()
+            self.statements[key] = sql
+        return sql
+
     def create_table(self, table_name, fields):
         """ create a table from the create_table_sql statement
         :obj conn: Connection object
@@ -29,21 +100,24 @@ class DBManager:
         """
         try:
             c = self.conn.cursor()
-            formatted_array = [f'{f["name"]} {f["type"]} {f["meta"]}' for f in fields]
-            sql_string = f'CREATE TABLE IF NOT EXISTS {table_name} ( {", ".join(formatted_array)} );'
+            formatted_array = [f'{self.check_identifier(f["name"])} {f["type"]} {f["meta"]}' for f in fields]
+            sql_string = f'CREATE TABLE IF NOT EXISTS {self.check_identifier(table_name)} ( {", ".join(formatted_array)} );'
             c.execute(sql_string)
+            self.columns.pop(table_name, None)
         except Exception as e:
             print(e)
 
     def get_colnames(self, table):
         """
-        Get column names from table
+        Get column names from table (read from the schema once, then cached)
         :string table: table name
         :return: list column names
         """
-        cur = self.conn.execute(f'SELECT * FROM {table}')
-        desc = cur.description
-        colnames = [r[0] for r in desc]
+        colnames = self.columns.get(table)
+        if colnames is None:
+            cur = self.conn.execute(f'PRAGMA table_info({self.check_identifier(table)})')
+            colnames = [r[1] for r in cur.fetchall()]
+            self.columns[table] = colnames
         return colnames
 
     def get_first_row(self, table):
@@ -52,11 +126,8 @@ class DBManager:
         :string table: table name
         :return: tuple row
         """
-        sql = f'SELECT * FROM {table} ORDER BY ROWID ASC LIMIT 1'
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        row = cur.fetchone()
-        return row
+        sql = self.statement(('first', table), lambda: f'SELECT * FROM {self.check_table(table)} ORDER BY ROWID ASC LIMIT 1')
+        return self.conn.execute(sql).fetchone()
 
     def get_row_by_id(self, table, id):
         """
@@ -65,11 +136,8 @@ class DBManager:
         :int id: row id
         :return: tuple row
         """
-        sql = f'SELECT * FROM {table} WHERE ID = {id}'
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        row = cur.fetchone()
-        return row
+        sql = self.statement(('by_id', table), lambda: f'SELECT * FROM {self.check_table(table)} WHERE ID = ?')
+        return self.conn.execute(sql, (id,)).fetchone()
 
     def get_all_rows(self, table):
         """
@@ -77,11 +145,8 @@ class DBManager:
         :string table: table name
         :return: tuple of tuples rows
         """
-        sql = f'SELECT * FROM {table}'
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        return rows
+        sql = self.statement(('all', table), lambda: f'SELECT * FROM {self.check_table(table)}')
+        return self.conn.execute(sql).fetchall()
 
     def get_row_count(self, table):
         """
@@ -89,11 +154,8 @@ class DBManager:
         :string table: table name
         :return: int row count
         """
-        sql = f'SELECT * FROM {table}'
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        return len(rows)
+        sql = self.statement(('count', table), lambda: f'SELECT COUNT(*) FROM {self.check_table(table)}')
+        return self.conn.execute(sql).fetchone()[0]
 
     def get_associated_items(self, table, field, id):
         """
@@ -103,21 +165,46 @@ class DBManager:
         :int id: row id
         :return: tuple row
         """
-        sql = f'SELECT * FROM {table} WHERE {field} = {id}'
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        return rows
+        sql = self.statement(('associated', table, field), lambda: f'SELECT * FROM {self.check_table(table)} WHERE {self.check_field(table, field)} = ?')
+        return self.conn.execute(sql, (id,)).fetchall()
+
+    def get_game_rows(self, table, game_id):
+        """
+        get the rows of a table for every map of a game in one query (e.g. all blocks in a game)
+        :string table: table name (with a MapID column)
+        :int game_id: game ID
+        :return: tuple of tuples rows, in table order
+        """
+        sql = self.statement(('game_rows', table), lambda: f'SELECT t.* FROM {self.check_table(table)} t JOIN Maps m ON t.MapID = m.ID WHERE m.GameID = ? ORDER BY t.ROWID')
+        return self.conn.execute(sql, (game_id,)).fetchall()
+
+    def get_game_items(self, game_id):
+        """
+        get the items on every map of a game joined with their ItemTypes, in one query
+        :int game_id: game ID
+        :return: tuple of tuples rows (Items columns, then TypeName, Description, Rarity, Value)
+        """
+        sql = ('SELECT i.*, t.Name AS TypeName, t.Description, t.Rarity, t.Value FROM Items i JOIN Maps m ON i.MapID = m.ID '
+                'LEFT JOIN ItemTypes t ON i.Type = t.ID WHERE m.GameID = ? ORDER BY i.ROWID')
+        return self.conn.execute(sql, (game_id,)).fetchall()
+
+    def get_inventory_items(self, creature_id):
+        """
+        get the items in a creature's inventory joined with their ItemTypes, in one query
+        :int creature_id: creature ID
+        :return: tuple of tuples rows (Items columns, then TypeName, Description, Rarity, Value)
+        """
+        sql = ('SELECT i.*, t.Name AS TypeName, t.Description, t.Rarity, t.Value FROM ItemInventory v JOIN Items i ON v.ItemID = i.ID '
+                'LEFT JOIN ItemTypes t ON i.Type = t.ID WHERE v.CreatureID = ? ORDER BY v.ROWID')
+        return self.conn.execute(sql, (creature_id,)).fetchall()
 
     def get_next_game_id(self):
         """
         Get the lowest available game ID
         :return: int id
         """
-        sql = f'SELECT * FROM Games ORDER BY ROWID DESC'
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
+        sql = 'SELECT * FROM Games ORDER BY ROWID DESC'
+        rows = self.conn.execute(sql).fetchall()
         counter = 1
         for row in rows:
             if row[0] != counter:
@@ -131,71 +218,144 @@ class DBManager:
         :string table: table name
         :return: int id
         """
-        sql = f'SELECT * FROM {table} ORDER BY ROWID DESC LIMIT 1'
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        row = cur.fetchone()
+        sql = self.statement(('last_id', table), lambda: f'SELECT ID FROM {self.check_table(table)} ORDER BY ROWID DESC LIMIT 1')
+        row = self.conn.execute(sql).fetchone()
         if row:
             return row[0] + 1
         return 1
 
-    def insert_row(self, table, row):
+    def get_user_version(self):
+        """
+        Get the schema version stored in the database header (PRAGMA user_version)
+        :return: int version
+        """
+        return self.conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def set_user_version(self, version):
+        """
+        Set the schema version stored in the database header
+        :int version: schema version
+        :return: None
+        """
+        self.conn.execute(f'PRAGMA user_version = {int(version)}')
+
+    def add_column(self, table, column, type):
+        """
+        Add a nullable column to a table, and forget the statements built on its old columns
+        :string table: table name
+        :string column: new column name
+        :string type: column type (e.g. REAL, INTEGER)
+        :return: None
+        """
+        self.conn.execute(f'ALTER TABLE {self.check_table(table)} ADD COLUMN {self.check_identifier(column)} {self.check_identifier(type)}')
+        self.columns.pop(table, None)
+        self.statements = {k: v for k, v in self.statements.items() if k[1] != table}
+
+    @contextmanager
+    def transaction(self):
+        """ runs a block of writes (schema changes included) as one transaction: committed once at the end, or rolled back if the block raises.
+        Pass commit=False to the write methods inside it
+        :return: None
+        """
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN')
+        try:
+            yield self
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def insert_row(self, table, row, commit=True):
         """
         Create a new row
         :string table: string table name
         :tuple row: tuple row values
+        :bool commit: whether to commit straight away (optional, default True)
         :return: int row id
         """
-        insert_str = f'({",".join(["?" for i in row])})'
-        sql = f'INSERT INTO {table}({",".join(self.get_colnames(table))}) VALUES{insert_str}'
-        cur = self.conn.cursor()
-        cur.execute(sql, row)
-        self.conn.commit()
+        cur = self.conn.execute(self.insert_statement(table, len(row)), tuple(row))
+        if commit:
+            self.conn.commit()
 
         return cur.lastrowid
 
-    def update_row(self, table, id, body):
+    def insert_rows(self, table, rows, commit=True):
+        """
+        Create many rows with one executemany
+        :string table: string table name
+        :list rows: list of tuple row values
+        :bool commit: whether to commit straight away (optional, default True)
+        :return: int rows written
+        """
+        rows = [tuple(r) for r in rows]
+        if not rows:
+            return 0
+        cur = self.conn.executemany(self.insert_statement(table, len(rows[0])), rows)
+        if commit:
+            self.conn.commit()
+        return cur.rowcount
+
+    def insert_statement(self, table, count):
+        ''' rows fill the table's columns in order. Shorter rows leave the trailing columns (e.g. ones added by a migration) to their defaults
+        '''
+        colnames = self.get_colnames(self.check_table(table))[:count]
+        return self.statement(('insert', table, count), lambda: f'INSERT INTO {table}({",".join(colnames)}) VALUES({",".join("?" * len(colnames))})')
+
+    def update_statement(self, table, fields):
+        return self.statement(('update', table, fields), lambda: f'UPDATE {self.check_table(table)} SET {", ".join(f"{self.check_field(table, f)} = ?" for f in fields)} WHERE id = ?')
+
+    def update_row(self, table, id, body, commit=True):
         """
         Update a row given its id
         :string table: string table name
         :int id: int id
         :dict body: update dict (key = column, value = update value)
+        :bool commit: whether to commit straight away (optional, default True)
         :return: int row id
         """
-        formatted_body_array = [f'{f} = "{body[f]}"' for f in body]
-        formatted_body_string = ', '.join(formatted_body_array)
-        sql = f'UPDATE {table} SET {formatted_body_string} WHERE id = {id}'
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        self.conn.commit()
+        self.conn.execute(self.update_statement(table, tuple(body)), tuple(body.values()) + (id,))
+        if commit:
+            self.conn.commit()
         return id
 
-    def delete_rows(self, table, ids, custom_field=None):
+    def update_rows(self, table, fields, rows, commit=True):
+        """
+        Update many rows that set the same columns with one executemany
+        :string table: string table name
+        :tuple fields: columns to set
+        :list rows: list of tuples (values in field order..., id)
+        :bool commit: whether to commit straight away (optional, default True)
+        :return: int rows written
+        """
+        cur = self.conn.executemany(self.update_statement(table, tuple(fields)), rows)
+        if commit:
+            self.conn.commit()
+        return cur.rowcount
+
+    def delete_rows(self, table, ids, custom_field=None, commit=True):
         """
         Delete a row given its id
         :string table: string table name
         :int id: list (int) ids
         :custom_field: string non-id field to check against (optional, default None)
-        :return: None
+        :bool commit: whether to commit straight away (optional, default True)
+        :return: int rows deleted
         """
         field = custom_field if custom_field else 'id'
         if len(ids) > 0 and ids[0] == '*':
-            sql = f'DELETE FROM {table}'
-            cur = self.conn.cursor()
-            cur.execute(sql)
-            self.conn.commit()
+            sql = self.statement(('delete_all', table), lambda: f'DELETE FROM {self.check_table(table)}')
+            cur = self.conn.execute(sql)
         else:
-            for id in ids:
-                sql = f'DELETE FROM {table} WHERE {field} = {id}'
-                cur = self.conn.cursor()
-                cur.execute(sql)
-                self.conn.commit()
+            sql = self.statement(('delete', table, field), lambda: f'DELETE FROM {self.check_table(table)} WHERE {self.check_field(table, field)} = ?')
+            cur = self.conn.executemany(sql, ((id,) for id in ids))
+        if commit:
+            self.conn.commit()
+        return cur.rowcount
 
     def get_id(self, table, name):
-        sql = f'SELECT * FROM {table} WHERE name LIKE "{name}"'
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        return_row = cur.fetchone()
+        sql = self.statement(('by_name', table), lambda: f'SELECT * FROM {self.check_table(table)} WHERE name LIKE ?')
+        return_row = self.conn.execute(sql, (name,)).fetchone()
         if return_row:
             return return_row[0]
         return None
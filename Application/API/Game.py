@@ -1,10 +1,17 @@
 import pygame
 import os
-import operator
 import time
 
 from pygame.constants import RESIZABLE
-from . import Creature, DBManager, Item, Map
+from . import Collision, Creature, DBManager, Item, Map, MapPool, Migrations, Pathfinding, Persistence, Prefetcher, Profiler, Renderer, WorldLoader
+
+PREFETCH_RADIUS = 300
+PREFETCH_INTERVAL = 15
+INTERACT_RADIUS = 24
+INTERACT_CONE = 90
+CLICK_RADIUS = 16
+MAX_TICKS_PER_FRAME = 5
+MAX_FRAME_TIME = 0.25
 
 class Game:
     """ Parent class for the main Game configurations
@@ -18,26 +25,74 @@ class Game:
     :object dialog_img: pygame rendered dialog box image
     :bool inventory: whether the inventory box is displayed
     :object inventory_img: pygame rendered inventory image
+    :object overlays: cache of the dialog and inventory images scaled to the screen, and of the composed inventory panel
     :str directory (input): game directory
     :str corner_icon (input): filepath for corner icon 
-    :int fps (input): game framerate
+    :int fps (input): maximum render framerate
+    :int tick_rate (input): simulation ticks per second. Speeds, NPC move ranges and animation timings are all counted in simulation ticks (optional: default fps)
+    :bool dirty_rects (input): whether to only repaint the regions of the screen that changed (optional: default False)
+    :bool headless (input): run without a window on SDL's dummy video driver, to be driven with step() (optional: default False)
+    :bool profile (input): time every phase of each frame into the frame profiler (optional: default False)
+    :int max_loaded_maps (input): maximum number of maps kept decoded in the map pool (optional: default 3)
+    :int map_memory_limit (input): maximum bytes of decoded map images in the map pool (optional: default 256 MB)
+    :bool vector_blocks (input): check each map's blocks with the numpy collision backend instead of the spatial hash, when numpy is installed (optional: default False)
+    :bool collision_mask (input): check each map's blocks and companion collision image through a precompiled collision mask (optional: default False, takes precedence over vector_blocks)
+    :bool batch_npcs (input): run each map's NPCs as one numpy batch instead of one NPC.action call each, when numpy is installed (optional: default False)
+    :object world: bulk loader reading every map of a game in a few queries, with the ItemTypes cache
+    :object maps: pool of the game's maps, built on first entry
+    :object prefetcher: background thread warming the destinations of nearby portals
+    :int transition_id: ID of the map being faded to, or None
+    :object renderer: dirty rect renderer, or None when every frame is fully repainted
+    :list visible_items: items on screen this frame (everything else is culled)
+    :list visible_creatures: creatures and monsters on screen this frame (everything else is culled)
+    :dict cull_stats: number of entities drawn and culled on the last frame
+    :dict collision_stats: number of bodies in the creature broadphase and candidate pairs it produced on the last tick
+    :object dirty: Persistence.DirtySet of the game's entities and their state as last saved. Saves only write what changed
+    :dict save_stats: rows written and seconds taken by the last save
+    :object pathfinder: A* service shared by every creature, searching within a time budget each rendered frame
+    :float accumulator: real time not yet simulated, in seconds. Whole ticks are drained from it every frame
+    :float alpha: how far the render pass is between the previous tick and the current one (0 to 1)
+    :dict previous: world location of each drawn entity before the last tick, for interpolating the render pass
+    :object profiler: per-phase frame timer, or None when profiling is off
+    :bool show_profile: whether the profiler percentiles are drawn on screen (toggled with F3)
     """
-    def __init__(self, id, screen_size: tuple, name: str, directory: str, corner_icon: str, fps: int):
+    def __init__(self, id, screen_size: tuple, name: str, directory: str, corner_icon: str, fps: int, dirty_rects: bool = False,
+                    max_loaded_maps: int = 3, map_memory_limit: int = 256 * 1024 * 1024, headless: bool = False, profile: bool = False,
+                    vector_blocks: bool = False, collision_mask: bool = False, batch_npcs: bool = False, tick_rate: int = None):
         self.id = id
+        self.headless = headless
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
         self.dbconn = DBManager.DBManager(os.path.join(directory, 'Database/main.db'))
+        Migrations.migrate(self.dbconn)
+        self.world = WorldLoader.WorldLoader(self.dbconn)
         self.screen_size = screen_size
         self.directory = directory
         self.screen = pygame.display.set_mode(screen_size, RESIZABLE)
         self.running = True
         self.start_game(name, os.path.join(directory, corner_icon))
+        self.dirty = Persistence.DirtySet()
         self.pc = self.load_character(self.id) if self.id != 0 else None
         self.dialog = False
         self.dialog_img = pygame.image.load(os.path.join(directory, 'Resources/dialog.png')).convert()
         self.inventory = False
         self.inventory_img = pygame.image.load(os.path.join(directory, 'Resources/inventory.png')).convert()
+        self.overlays = Renderer.OverlayCache({'dialog': self.dialog_img, 'inventory': self.inventory_img})
         self.fps = fps
+        self.tick_rate = tick_rate or fps
+        self.tick_length = 1 / self.tick_rate
+        self.accumulator = 0.0
+        self.pending_events = []
         self.clock = pygame.time.Clock()
-        self.maps = self.load_all_maps()
+        self.max_loaded_maps = max_loaded_maps
+        self.map_memory_limit = map_memory_limit
+        self.vector_blocks = vector_blocks
+        self.collision_mask = collision_mask
+        self.batch_npcs = batch_npcs
+        self.map = None
+        self.prefetcher = Prefetcher.MapPrefetcher(os.path.join(directory, 'Database/main.db'), directory)
+        self.maps = self.load_map_pool()
         self.map = self.load_map(self.id, True)
         self.npc_move_count = 0
 
@@ -47,24 +102,26 @@ class Game:
         self.veil.set_alpha(self.veil_alpha)
         self.fade_out = False
         self.fade_in = False
-        self.transition_map = None
-
-    def load_all_maps(self):
-        """ Loads and processes all maps associated with the game, given the Game ID
-        :return: list of object Maps
+        self.transition_id = None
+        self.renderer = Renderer.DirtyRectRenderer(self.screen_size) if dirty_rects else None
+        self.visible_items = []
+        self.visible_creatures = []
+        self.cull_stats = {'drawn': 0, 'culled': 0}
+        self.collision_stats = {'bodies': 0, 'candidate_pairs': 0}
+        self.save_stats = {'rows': 0, 'elapsed': 0.0}
+        self.pathfinder = Pathfinding.Pathfinder()
+        self.alpha = 1.0
+        self.previous = {}
+        self.previous_view = None
+        self.profiler = Profiler.FrameProfiler() if profile else None
+        self.show_profile = False
+
+    def load_map_pool(self):
+        """ Creates the pool that builds the game's maps on first entry, given the Game ID
+        :return: object MapPool
         """
-        return_array = []
-        db_maps = self.dbconn.get_associated_items('Maps', 'GameID', self.id)
-        for m in db_maps:
-            coords = [float(m[3].split(', ')[0]), float(m[3].split(', ')[1])]
-            pc_start = [int(m[5].split(', ')[0]), int(m[5].split(', ')[1])]
-            map = Map.Map(self.dbconn, m[0], m[1], self.directory, m[2], coords, m[4], pc_start)
-            if map.dimensions[0] < self.screen_size[0]:
-                map.location[0] = (self.screen_size[0] / 2) - (map.dimensions[0] / 2)
-            if map.dimensions[1] < self.screen_size[1]:
-                map.location[1] = (self.screen_size[1] / 2) - (map.dimensions[1] / 2)
-            return_array.append(map)
-        return return_array
+        self.prefetcher.clear()
+        return MapPool.MapPool(self.dbconn, self.id, self.directory, self.max_loaded_maps, self.map_memory_limit, self.prefetcher, self.world)
 
 
     def load_map(self, id: int, is_init = False):
@@ -73,21 +130,23 @@ class Game:
         :bool is_init: Is initial map (true if loading game, false if loading map)(optional: default False)
         :return: object Map
         """
-        if is_init:
-            possible_maps = self.dbconn.get_associated_items('Maps', 'GameID', id)
-            for map in possible_maps:
-                if map[6] == 1:
-                    map_id = map[0]
-        else:
-            map_id = id
-        for map in self.maps:
-            if map.id == map_id:
-                self.screen.fill((0, 0, 0))
-                if self.id != 0:
-                    self.pc.location = map.pc_start
-                if map.type == 'static':
-                    map.location = [(((map.dimensions[0] // 2) - (self.screen_size[0] // 2)) * -1), (((map.dimensions[1] // 2) - (self.screen_size[1] // 2)) * -1)]
-                return map
+        map_id = self.maps.default_id() if is_init else id
+        map = self.maps.get(map_id, self.map.id if self.map else None)
+        if map:
+            if self.collision_mask:
+                map.compile_collision()
+            elif self.vector_blocks:
+                map.vectorize_blocks()
+            if self.batch_npcs:
+                map.batch_creatures(self.tick_rate)
+            self.dirty.attach(map.items + map.creatures + map.monsters)
+            if self.id != 0:
+                self.pc.location = list(map.pc_start)
+            if map.type == 'static' or self.id == 0:
+                map.camera.center(map.dimensions, self.screen_size)
+            else:
+                map.camera.follow(self.pc.location, self.pc.size, map.dimensions, self.screen_size)
+            return map
 
     
     def start_game(self, name: str, corner_icon: str):
@@ -101,121 +160,339 @@ class Game:
         icon = pygame.image.load(corner_icon)
         pygame.display.set_icon(icon)
 
-    def movement_handler(self, blockers: list, char_limit: float, char_relate, map_limit: float, map_relate, pos_index: int, 
-                            range_index: int, direction: str, speed: float, index_rate: int, add_dimensions: bool):
-        """ Handles the main movement mechanic for the PC
-        :list blockers: list of unpassable rectangular objects
-        :float char_limit: the limit the pc can move in a certain direction (usually the game screen boundary)
-        :operator char_relate: whether the position comparison is greater or less than
-        :float map_limit: the map boundary of a certain direction
-        :operator map_relateL whether the map comparison is greater or less than
-        :int pos_index: whether the character position being changed is the X or Y
-        :int range_index: whether the pc's x or y coordinate is compared with the blockers
+    def movement_handler(self, velocity: tuple, direction: str, index_rate: int):
+        """ Handles the main movement mechanic for the PC. Its rect is swept along the whole velocity in one query, stopping at the first blocker and sliding along it.
+        The pc moves in world coordinates and the map camera follows it
+        :tuple velocity: the pc's movement this tick, combined from every held direction (float x, float y)
         :str direction: whether the PC is heading N, S, E, or W
-        :float speed: the pc's speed
-        :index_rate: the rate of sprite image swapping for the pc (equation: fps / number of animation sprites * (1 / speed * 2))
-        :bool add_dimensions: whether to add the size of the blocker to its coordinate (i.e. if approaching from the south or east)
+        :index_rate: the rate of sprite image swapping for the pc (equation: tick rate / number of animation sprites * (1 / speed * 2))
         :return: None
         """
-        interact_obj = self.pc.check_surroundings(blockers, pos_index, range_index, add_dimensions)
-        if type(interact_obj) == Map.Portal:
-            self.fade_out = True
-            self.transition_map = self.load_map(interact_obj.get_map())
-            print(interact_obj.get_map())
-        elif not interact_obj:
-            if char_relate(self.pc.location[pos_index], self.screen_size[pos_index] / 2 - 32) and char_relate(self.pc.location[pos_index], char_limit):
-                self.pc.location[pos_index] += speed
-            elif map_relate(self.map.location[pos_index], map_limit):
-                self.map.move(pos_index, 0 - speed)
-            elif char_relate(self.pc.location[pos_index], char_limit):
-                self.pc.location[pos_index] += speed
+        blockers = self.map.get_movement_blockers(self.pc, velocity)
+        location, hits = Collision.move_and_slide(self.pc.location, self.pc.size, velocity, blockers, self.map.static)
+        portals = [h for h in hits if type(h) == Map.Portal]
+        if portals:
+            self.start_transition(portals[0].get_map())
+            print(portals[0].get_map())
+        else:
+            location[0] = max(0, min(location[0], self.map.dimensions[0] - self.pc.size[0] - 1))
+            location[1] = max(0, min(location[1], self.map.dimensions[1] - self.pc.size[1] - 10))
+            self.pc.location = location
         self.pc.direction = direction
         self.pc.icon = self.pc.icons[direction][self.pc.icon_index // index_rate]
 
 
+    def start_transition(self, map_id: int):
+        """ fades out to another map. The map is prefetched in the background while the veil fades
+        :int map_id: destination map ID
+        :return: None
+        """
+        self.fade_out = True
+        self.transition_id = map_id
+        self.maps.prefetch(map_id)
+
+    def prefetch_nearby_maps(self):
+        """ starts prefetching the destination of every portal within PREFETCH_RADIUS of the pc
+        :return: None
+        """
+        pc_x = self.pc.location[0] + self.pc.size[0] / 2
+        pc_y = self.pc.location[1] + self.pc.size[1] / 2
+        for p in self.map.portals:
+            dx = max(p.location[0] - pc_x, 0, pc_x - p.location[0] - p.size[0])
+            dy = max(p.location[1] - pc_y, 0, pc_y - p.location[1] - p.size[1])
+            if dx * dx + dy * dy < PREFETCH_RADIUS * PREFETCH_RADIUS:
+                self.maps.prefetch(p.get_map())
+
     def get_index_rate(self, icons, speed):
-        return self.fps // len(icons) * int(1/speed * 2)
+        return max(1, self.tick_rate // len(icons) * int(1/speed * 2))
 
 
     def update_display(self):
-        ''' Main function to update the map display
+        ''' Main function to update the map display (one real-time frame: throttle, events, as many fixed simulation ticks as the elapsed time covers, render)
+        The render pass interpolates between the last two ticks, so gameplay speed follows the tick rate whatever the frame rate.
+        The pathfinder gets its search budget once per frame, however many ticks ran. After a long stall at most MAX_TICKS_PER_FRAME ticks are run and the rest of the backlog is dropped
         :return: None        
         '''
+        prof = self.profiler
+        if prof:
+            prof.begin_frame()
+        elapsed = self.clock.tick(self.fps) / 1000
+        self.accumulator += min(elapsed, MAX_FRAME_TIME)
+        self.pending_events += pygame.event.get()
+        if prof:
+            prof.mark('throttle')
+        ticks = 0
+        while self.accumulator >= self.tick_length and ticks < MAX_TICKS_PER_FRAME:
+            self.snapshot()
+            self.tick(self.pending_events)
+            self.pending_events = []
+            self.accumulator -= self.tick_length
+            ticks += 1
+        if ticks == MAX_TICKS_PER_FRAME:
+            self.accumulator = min(self.accumulator, self.tick_length)
+        self.pathfinder.process()
+        if prof:
+            prof.mark('paths')
+        self.alpha = min(1.0, self.accumulator / self.tick_length)
+        self.render()
+        if prof:
+            prof.end_frame()
+
+    def step(self, n_ticks: int, inputs=None, render: bool = False):
+        ''' Advances the game by a number of ticks as fast as the CPU allows, without the frame throttle (headless benchmarks, playtests)
+        :int n_ticks: number of ticks to simulate
+        :inputs: events to handle on each tick, either a list (index = tick) or a dict (key = tick) of lists of pygame events (optional: default None)
+        :bool render: whether to draw each tick to the (possibly dummy) screen (optional: default False)
+        :return: None
+        '''
+        for t in range(n_ticks):
+            events = []
+            if isinstance(inputs, dict):
+                events = inputs.get(t, [])
+            elif inputs and t < len(inputs):
+                events = inputs[t]
+            if self.profiler:
+                self.profiler.begin_frame()
+            self.tick(events)
+            self.pathfinder.process()
+            if self.profiler:
+                self.profiler.mark('paths')
+            self.alpha = 1.0
+            if render:
+                self.render()
+            if self.profiler:
+                self.profiler.end_frame()
+            if not self.running:
+                break
+
+    def snapshot(self):
+        ''' records where the view and every drawn entity are before a tick, so the render pass can interpolate from there
+        :return: None
+        '''
+        self.previous = {creature: tuple(creature.location) for creature in self.visible_creatures}
+        for item in self.visible_items:
+            self.previous[item] = tuple(item.location)
+        if self.pc:
+            self.previous[self.pc] = tuple(self.pc.location)
+        self.previous_view = (self.map, tuple(self.map.camera.offset))
+
+    def interpolate(self, obj):
+        ''' world location of an entity at the render pass's point between the previous tick and the current one
+        :obj obj: anything with a location that was drawn last tick
+        :return: tuple world coordinates (float x, float y)
+        '''
+        before = self.previous.get(obj)
+        if before is None or self.alpha >= 1 or self.previous_view[0] is not self.map:
+            return tuple(obj.location)
+        return (before[0] + (obj.location[0] - before[0]) * self.alpha, before[1] + (obj.location[1] - before[1]) * self.alpha)
+
+    def view_offset(self):
+        ''' camera offset interpolated the same way as the entities
+        :return: tuple screen coordinates of the map's top left corner (float x, float y)
+        '''
+        offset = self.map.camera.offset
+        if self.previous_view is None or self.alpha >= 1 or self.previous_view[0] is not self.map:
+            return tuple(offset)
+        before = self.previous_view[1]
+        return (before[0] + (offset[0] - before[0]) * self.alpha, before[1] + (offset[1] - before[1]) * self.alpha)
+
+    def to_screen(self, obj, offset: tuple):
+        ''' screen coordinates of an entity for the render pass
+        :obj obj: anything with a location
+        :tuple offset: interpolated camera offset (Game.view_offset)
+        :return: tuple screen coordinates (float x, float y)
+        '''
+        location = self.interpolate(obj)
+        return (location[0] + offset[0], location[1] + offset[1])
+
+    def tick(self, events: list):
+        ''' Advances the simulation by one fixed tick (1 / tick_rate seconds): fades, events, pc movement, item animation and creature actions
+        :list events: pygame events to handle this tick
+        :return: None
+        '''
+        prof = self.profiler
         # increase or decrease veil alpha if screen is set to fade out
+        # the veil waits fully faded out until the destination map has finished prefetching (headless games block on it so ticks stay deterministic)
         if self.fade_out:
-            self.veil_alpha += 5
-            if self.veil_alpha >= 255:
+            self.veil_alpha = min(255, self.veil_alpha + 5)
+            if self.veil_alpha >= 255 and self.maps.is_ready(self.transition_id, self.headless):
                 self.fade_out = False
-                self.map = self.transition_map                    
+                self.map = self.load_map(self.transition_id)
                 self.fade_in = True
-                self.transition_map = None
+                self.transition_id = None
+                self.maps.evict((self.map.id,))
         elif self.fade_in:
             self.veil_alpha -= 5
             if self.veil_alpha <= 0:
                 self.fade_in = False 
 
-
-        self.clock.tick(self.fps)
-        if self.npc_move_count > self.fps * 3:
+        if self.npc_move_count > self.tick_rate * 3:
             self.npc_move_count = 0
+        if prof:
+            prof.mark('fade')
         # iterate through all user-defined events to see if the event queue needs to be cleared
-        for event in pygame.event.get():
+        for event in events:
             does_clear_queue = self.handle_event(event)
             if does_clear_queue:
               pygame.event.clear()
-
-        # get all current map blocker locations. If the pc is moving, calculate index rate and pass functions to movement handler
-        self.screen.blit(self.map.image, tuple(self.map.location)) 
+        if prof:
+            prof.mark('events')
+
+        # pair up the creatures, monsters and pc that may touch this tick
+        pairs = self.map.update_broadphase(self.pc)
+        self.collision_stats = {
+            'bodies': len(self.map.broadphase.order),
+            'candidate_pairs': pairs
+        }
+        # if the pc is moving, calculate index rate and move it by the combined velocity of every held direction (the last one listed sets the sprite)
         if self.id != 0:
-            if self.pc.moveup or self.pc.movedown or self.pc.moveleft or self.pc.moveright:
-                blockers = self.map.items + self.map.blocks + self.map.creatures + self.map.portals
+            held = [d for d, moving in (('N', self.pc.moveup), ('S', self.pc.movedown), ('W', self.pc.moveleft), ('E', self.pc.moveright)) if moving]
+            if held:
                 index_rate = self.get_index_rate(self.pc.icons['E'], self.pc.speed)
                 self.pc.icon_index += 1
                 if self.pc.icon_index // index_rate == len(self.pc.icons['E']):
                     self.pc.icon_index = 0
-            if self.pc.moveup:
-                self.movement_handler(blockers, -0.1, operator.gt, 0, operator.le, 1, 0, 'N', 0 - self.pc.speed, index_rate, True)
-            if self.pc.movedown:
-                self.movement_handler(blockers, min(self.screen_size[1] - self.pc.size[1] - 10, self.map.dimensions[1] - self.pc.size[1] - 10), 
-                                        operator.lt, self.screen_size[1] - self.map.dimensions[1], operator.ge, 1, 0, 'S', self.pc.speed, index_rate, False)
-            if self.pc.moveleft:
-                self.movement_handler(blockers, -0.1, operator.gt, 0, operator.le, 0, 1, 'W', 0 - self.pc.speed, index_rate, True)
-            if self.pc.moveright:
-                self.movement_handler(blockers, min(self.screen_size[0] - self.pc.size[1] - 1, self.map.dimensions[0] - self.pc.size[0] - 1), 
-                                        operator.lt, self.screen_size[0] - self.map.dimensions[0], operator.ge, 0, 1, 'E', self.pc.speed, index_rate, False)
-            if self.transition_map == None:
-                self.screen.blit(self.pc.icon, tuple(self.pc.location))
-        # blit the map, pc location, items, and if necessary the dialog box or inventory
-        
-        
-
-
+                velocity = ((self.pc.moveright - self.pc.moveleft) * self.pc.speed, (self.pc.movedown - self.pc.moveup) * self.pc.speed)
+                self.movement_handler(velocity, held[-1], index_rate)
+            if self.map.type != 'static':
+                self.map.camera.follow(self.pc.location, self.pc.size, self.map.dimensions, self.screen_size)
+            if self.transition_id == None and self.npc_move_count % PREFETCH_INTERVAL == 0:
+                self.prefetch_nearby_maps()
+        if prof:
+            prof.mark('movement')
+
+        # drop the items that were picked up, then animate on-screen items and run creature actions
+        # off-screen entities are culled: items skip animation and creatures only move
+        self.map.remove_inventoried()
+        camera = self.map.camera
+        self.visible_items = []
         for item in self.map.items:
-            item.animate(self.fps, self.npc_move_count)
-            if not item.inventoried:
-                self.screen.blit(item.icon, tuple(item.location))
+            if camera.is_visible(item.location, item.icon.get_size(), self.screen_size):
+                item.animate(self.tick_rate, self.npc_move_count)
+                self.visible_items.append(item)
+        if prof:
+            prof.mark('items')
+        if self.map.npc_batch is not None:
+            self.visible_creatures = self.map.npc_batch.update(self.npc_move_count, self.pc, self.map, camera, self.screen_size)
+            actors = self.map.monsters
+        else:
+            self.visible_creatures = []
+            actors = self.map.creatures + self.map.monsters
+        for creature in actors:
+            if camera.is_visible(creature.location, creature.icon.get_size(), self.screen_size):
+                npc_index_rate = self.get_index_rate(creature.icons['E'], creature.speed)
+                creature.action(self.tick_rate, self.npc_move_count, npc_index_rate, self.pc, True, self.map)
+                self.visible_creatures.append(creature)
             else:
-                self.map.items.remove(item)
-        for creature in self.map.creatures:
-            npc_index_rate = self.get_index_rate(creature.icons['E'], creature.speed)
-            creature.action(self.fps, self.npc_move_count, npc_index_rate, self.pc)
-            self.screen.blit(creature.icon, tuple(creature.location))
-        if self.dialog:
-            self.dialog_img = pygame.transform.smoothscale(self.dialog_img, (self.screen_size[0] - 100, self.screen_size[1] // 4))
-            self.screen.blit(self.dialog_img, (50, int(self.screen_size[1] * 0.75 - 50)))
-        if self.inventory:
-            self.inventory_img = pygame.transform.smoothscale(self.inventory_img, (self.screen_size[0] - 100, self.screen_size[1] // 2))
-            self.screen.blit(self.inventory_img, (50, int(self.screen_size[1] * 0.5 - 50)))
-            inv_x = 80
-            inv_y = int(self.screen_size[1] * 0.5 - 20)
-            for item in self.pc.inventory:
-                self.screen.blit(item.inv_icon, (inv_x, inv_y))
-                inv_x += self.inventory_img.get_width() / 9
+                creature.action(self.tick_rate, self.npc_move_count, 1, self.pc, False, self.map)
+            self.map.spatial.update(creature)
+        # strays are sent home on the last tick of the cycle, so their paths are searched before the next cycle starts and an NPC that gets home on its first tick still wanders
+        if self.npc_move_count == self.tick_rate * 3:
+            self.recall_strays()
+        drawn = len(self.visible_items) + len(self.visible_creatures)
+        self.cull_stats = {
+            'drawn': drawn,
+            'culled': len(self.map.items) + len(self.map.creatures) + len(self.map.monsters) - drawn
+        }
         self.npc_move_count += 1
         self.veil.set_alpha(self.veil_alpha)
-        self.screen.blit(self.veil, (0, 0))
+        if prof:
+            prof.mark('npcs')
 
-        pygame.display.update()
+    def recall_strays(self):
+        ''' sends the NPCs and monsters that have ended up outside their wander bounds (e.g. pushed there, or placed there by the map data)
+        back inside along a path from the pathfinder. Called on the last tick of each NPC movement cycle
+        :return: int number of paths requested
+        '''
+        sent = 0
+        for creature in self.map.creatures + self.map.monsters:
+            if creature.path is None and not creature.is_talking and not creature.in_bounds():
+                creature.walk_to(self.pathfinder, self.map, creature.home())
+                sent += 1
+        return sent
+
+    def render(self):
+        ''' draws the current state and presents it, fully or through the dirty rect renderer
+        :return: None
+        '''
+        prof = self.profiler
+        if self.dialog:
+            self.get_dialog_overlay()
+        if self.inventory:
+            self.get_inventory_overlay()
+        if prof:
+            prof.mark('overlays')
+        if self.renderer:
+            self.track_dirty_rects()
+            if prof:
+                prof.mark('draw')
+            self.renderer.present(self.screen, self.draw_scene)
+        else:
+            self.draw_scene()
+            if prof:
+                prof.mark('draw')
+            pygame.display.update()
+        if prof:
+            prof.mark('present')
+
+    def draw_scene(self):
+        ''' blits the map, pc, items, creatures, and if necessary the dialog box, inventory and veil onto the screen
+        :return: None
+        '''
+        offset = self.view_offset()
+        map_rect = pygame.Rect(int(offset[0]), int(offset[1]), self.map.dimensions[0], self.map.dimensions[1])
+        if not map_rect.contains(self.screen.get_rect()):
+            self.screen.fill((0, 0, 0))
+        self.map.image.draw(self.screen, offset)
+        if self.id != 0 and self.transition_id == None:
+            self.screen.blit(self.pc.icon, self.to_screen(self.pc, offset))
+        for item in self.visible_items:
+            self.screen.blit(item.icon, self.to_screen(item, offset))
+        for creature in self.visible_creatures:
+            self.screen.blit(creature.icon, self.to_screen(creature, offset))
+        if self.dialog:
+            self.screen.blit(self.get_dialog_overlay(), (50, int(self.screen_size[1] * 0.75 - 50)))
+        if self.inventory:
+            self.screen.blit(self.get_inventory_overlay(), (50, int(self.screen_size[1] * 0.5 - 50)))
+        if self.veil_alpha > 0:
+            self.screen.blit(self.veil, (0, 0))
+        if self.profiler and self.show_profile:
+            self.screen.blit(self.profiler.overlay(), (0, 0))
+
+    def track_dirty_rects(self):
+        ''' reports everything drawn this frame to the dirty rect renderer so only changed regions are repainted
+        :return: None
+        '''
+        offset = self.view_offset()
+        self.renderer.watch('view', (self.map.id, offset, self.veil_alpha))
+        if self.id != 0 and self.transition_id == None:
+            self.renderer.track('pc', self.to_screen(self.pc, offset), self.pc.icon.get_size(), id(self.pc.icon))
+        for item in self.visible_items:
+            self.renderer.track(item, self.to_screen(item, offset), item.icon.get_size(), id(item.icon))
+        for creature in self.visible_creatures:
+            self.renderer.track(creature, self.to_screen(creature, offset), creature.icon.get_size(), id(creature.icon))
+        if self.dialog:
+            dialog_img = self.get_dialog_overlay()
+            self.renderer.track('dialog', (50, int(self.screen_size[1] * 0.75 - 50)), dialog_img.get_size(), id(dialog_img))
+        if self.inventory:
+            inventory_img = self.get_inventory_overlay()
+            self.renderer.track('inventory', (50, int(self.screen_size[1] * 0.5 - 50)), inventory_img.get_size(), id(inventory_img))
+        if self.profiler and self.show_profile:
+            profile_img = self.profiler.overlay()
+            self.renderer.track('profile', (0, 0), profile_img.get_size(), id(profile_img))
+
+    def get_dialog_overlay(self):
+        ''' the dialog box scaled to the current screen size
+        :return: pygame Surface
+        '''
+        return self.overlays.get('dialog', (self.screen_size[0] - 100, self.screen_size[1] // 4))
+
+    def get_inventory_overlay(self):
+        ''' the inventory box scaled to the current screen size, with the pc's inventory drawn on it
+        :return: pygame Surface
+        '''
+        inventory = self.pc.inventory if self.pc else []
+        return self.overlays.inventory_panel((self.screen_size[0] - 100, self.screen_size[1] // 2), inventory)
 
 
     def load_character(self, game_id: int):
@@ -224,22 +501,21 @@ class Game:
         '''
         c = self.dbconn.get_row_by_id('PC', game_id)
         coords = [self.screen_size[0] / 2 -32, self.screen_size[1] / 2 - 32]
-        size = (int(c[3].split(', ')[0]), int(c[3].split(', ')[1]))
+        size = tuple(Persistence.read_numbers(c, Persistence.SIZE, int))
         speed = float(c[4])
         actions = c[6].split(', ') if c[6] else []
-        inventory_ids = [s[2] for s in self.dbconn.get_associated_items('ItemInventory', 'CreatureID', c[0])]
         inventory = []
-        for id in inventory_ids:
-            i = self.dbconn.get_row_by_id('Items', id)
-            item_type = self.dbconn.get_row_by_id('ItemTypes', i[6])
-            coords = [float(i[2].split(', ')[0]), float(i[2].split(', ')[1])]
-            size = (int(i[3].split(', ')[0]), int(i[3].split(', ')[1]))
+        for i in self.dbconn.get_inventory_items(c[0]):
+            item_type = (i.Type, i.TypeName, i.Description, i.Rarity, i.Value)
+            item_coords = Persistence.read_numbers(i, Persistence.LOCATION)
+            item_size = tuple(Persistence.read_numbers(i, Persistence.SIZE, int))
             inv = False if i[4] == 0 else True
-            item = Item.Item(i[0], self.directory, i[1], coords, size, i[5], item_type[1], item_type[2], item_type[3], item_type[4], inv)
+            item = Item.Item(i[0], self.directory, i[1], item_coords, item_size, i[5], item_type[1], item_type[2], item_type[3], item_type[4], inv)
             inventory.append(item)
         pc = Creature.MainPC(self.directory, c[0], c[1], coords, size, speed, c[5], actions, c[7],
                                 c[8], c[9], c[10], c[11], c[12], c[13], c[14], c[15], c[16], c[17], 
                                 c[18], c[19], c[20], c[21], c[22], c[23], c[24], c[25], inventory)
+        self.dirty.attach([pc] + inventory)
         return pc
 
     def change_screen(self, new_size):
@@ -249,7 +525,10 @@ class Game:
         """
         self.screen_size = new_size
         self.load_map(self.map.id)
-        self.screen.blit(self.map.image, tuple(self.map.location))
+        self.map.image.draw(self.screen, self.map.location)
+        self.overlays.invalidate()
+        if self.renderer:
+            self.renderer.resize(new_size)
 
 
     def new_game(self):
@@ -266,8 +545,8 @@ class Game:
             self.dbconn.insert_row('Games', [new_game_id])
             template_connection = DBManager.DBManager(os.path.join(self.directory, 'Database/template.db'))
             template_maps = template_connection.get_all_rows('Maps')
-            for map in template_maps:
-                map = list(map)
+            for template_map in template_maps:
+                map = list(template_map)
                 map[1] = new_game_id
                 old_id = map[0]
                 tables_to_update = ['Items', 'Blocks', 'Monsters', 'NPCs', 'PC', 'Portals']
@@ -277,112 +556,103 @@ class Game:
                         new_item_id = new_game_id
                     else:
                         new_item_id = self.dbconn.get_next_id(table)
-                    for item in template_rows:
-                        item = list(item)
+                    for row in template_rows:
+                        item = list(row)
                         if table == 'Portals':
                             item[4] = new_map_id + item[4] - item[1]
                         item[0] = new_item_id
                         item[1] = new_map_id
                         self.dbconn.insert_row(table, item)
+                        self.copy_numeric_columns(table, item[0], row)
                         new_item_id += 1
                 map[0] = new_map_id
                 self.dbconn.insert_row('Maps', map)
+                self.copy_numeric_columns('Maps', map[0], template_map)
                 new_map_id += 1  
             self.load_game(new_game_id)
         # except Exception as e:
         #     print(e)
         #     return False
 
+    def copy_numeric_columns(self, table, id, row):
+        """ sub-function of new_game: fills the numeric columns of a row copied from the template from its text columns.
+        The template is kept in the legacy layout, so they would otherwise be left NULL
+        :str table: table name
+        :int id: ID of the new row
+        :namedtuple row: template row
+        return: None
+        """
+        columns = Migrations.numeric_columns(table, row)
+        if columns:
+            self.dbconn.update_row(table, id, columns)
+
     def save_game(self):
-        """ save a game given a game ID
+        """ save the changes made to a game since its last save. Only the entities whose persisted attributes changed since then (see Persistence.DirtySet) are written, and only their changed columns.
+        All locations are saved in world coordinates. The row changes are collected first, then written with executemany in one transaction
         return: bool success
         """
         # try:
-        print(self.id)
-        for map in self.maps:
-            for item in map.items:
-                inventoried = 1 if item.inventoried else 0
-                item_dict = {
-                    'MapID': item.map_id,
-                    'Location': ', '.join([str(i) for i in item.location]),
-                    'Inventoried': inventoried
-                }
-                self.dbconn.update_row('Items', item.id, item_dict)
-            for creature in map.creatures:
-                c_dict = {
-                    'MapID': creature.map_id,
-                    'Location': ', '.join([str(c) for c in creature.location]),
-                    'Speed': creature.speed
+        start = time.perf_counter()
+        changed = self.dirty.pop()
+        updates = {}
+        inventory = {'deletes': [], 'inserts': []}
+        for obj, fields in changed.items():
+            if isinstance(obj, Item.Item) and obj.inventoried:
+                row = {
+                    'MapID': 99999,
+                    'Inventoried': 1
                 }
-                self.save_creature(creature, 'NPCs', c_dict)
-            for monster in map.monsters:
-                m_dict = {
-                    'MapID': monster.map_id,
-                    'Location': ', '.join([str(l) for l in monster.location]),
-                    'Speed': monster.speed,
-                    'HeadEquip': monster.head_equip,
-                    'BodyEquip': monster.body_equip,
-                    'MeleeEquip': monster.melee_equip,
-                    'RangedEquip': monster.ranged_equip,
-                    'SpellEquip': monster.spell_equip
-                }
-                self.save_creature(monster, 'Monsters', m_dict)
-        for inventoried_item in self.pc.inventory:
-            inventory_dict = {
-                'MapID': 99999,
-                'Inventoried': 1
-            }
-            self.dbconn.update_row('Items', inventoried_item.id, inventory_dict)
-        p = self.pc
-        p_dict = {
-            'Size': ', '.join([str(p) for p in p.size]),
-            'Speed': p.speed,
-            'Name': p.name,
-            'Strength': p.strength,
-            'Accuracy': p.accuracy,
-            'Intelligence': p.intelligence,
-            'Dexterity': p.dexterity,
-            'CurrHP': p.currHP,
-            'MaxHP': p.maxHP,
-            'Melee': p.melee,
-            'Ranged': p.ranged,
-            'Magic': p.magic,
-            'Farming': p.farming,
-            'Trading': p.trading,
-            'Fishing': p.fishing,
-            'Handling': p.handling,
-            'Alchemy': p.alchemy,
-            'HeadEquip': p.head_equip,
-            'BodyEquip': p.body_equip,
-            'MeleeEquip': p.melee_equip,
-            'RangedEquip': p.ranged_equip,
-            'SpellEquip': p.spell_equip
-        }
-        self.save_creature(p, 'PC', p_dict)
-        print('wwwwooooootst34k')
+            else:
+                row = {}
+                for name, column in obj.persisted.items():
+                    if column and name in fields:
+                        row.update(Persistence.to_columns(column, getattr(obj, name)))
+            if row:
+                self.queue_update(updates, obj.table, obj.id, row)
+            if 'inventory' in fields:
+                self.save_inventory(obj, inventory)
+        written = 0
+        try:
+            with self.dbconn.transaction():
+                written += self.dbconn.delete_rows('ItemInventory', inventory['deletes'], 'ItemID', commit=False)
+                written += self.dbconn.insert_rows('ItemInventory', inventory['inserts'], commit=False)
+                for (table, fields), rows in updates.items():
+                    written += self.dbconn.update_rows(table, fields, rows, commit=False)
+        except Exception:
+            self.dirty.merge(changed)
+            raise
+        self.save_stats = {'rows': written, 'elapsed': time.perf_counter() - start}
+        if self.profiler:
+            print(f'saved game {self.id}: {written} rows in {self.save_stats["elapsed"] * 1000:.1f} ms')
         return True
         # except Exception as e:
         #     print(e)
         #     return False
 
-    def save_creature(self, creature_obj, table, row):
-        """ sub-function of save_game for saving PC, NPCs and monsters
-        :obj creature: Creature object to save
+    def queue_update(self, updates, table, id, row):
+        """ sub-function of save_game: groups a row update with the others that set the same columns, for one executemany each
+        :dict updates: pending updates, lists of (values..., id) keyed by (table, columns)
         :str table: table name to save to
+        :int id: row ID
         :dict row: dictionary containing fields, values to update for the row
-        return: bool success
+        return: None
+        """
+        updates.setdefault((table, tuple(row)), []).append(tuple(row.values()) + (id,))
+
+    def save_inventory(self, creature_obj, inventory):
+        """ sub-function of save_game for saving the inventory of the PC, NPCs and monsters
+        :obj creature: Creature object whose inventory changed
+        :dict inventory: pending ItemInventory deletes (item IDs) and inserts (rows)
+        return: None
         """
         db_inventory_ids = [s[2] for s in self.dbconn.get_associated_items('ItemInventory', 'CreatureID', creature_obj.id)]
         pc_inventory_ids = [s.id for s in creature_obj.inventory]
-        rows_to_delete = []
         for i in db_inventory_ids:
             if i not in pc_inventory_ids:
-                rows_to_delete.append(i)
-        self.dbconn.delete_rows('ItemInventory', rows_to_delete, 'ItemID')
+                inventory['deletes'].append(i)
         for p in pc_inventory_ids:
             if p not in db_inventory_ids:
-                self.dbconn.insert_row('ItemInventory', [creature_obj.id, 'P', p])
-        self.dbconn.update_row(table, creature_obj.id, row)
+                inventory['inserts'].append((creature_obj.id, 'P', p))
 
     def load_game(self, id):
         """ loads a game given a game ID
@@ -390,14 +660,15 @@ class Game:
         return: bool success
         """
         # try:
+        self.dirty = Persistence.DirtySet()
         self.pc = self.load_character(id)
         self.id = id
         self.dialog = False
         self.inventory = False
         self.clock = pygame.time.Clock()
-        self.maps = self.load_all_maps()
-        self.fade_out = True
-        self.transition_map = self.load_map(self.id, True)
+        self.accumulator = 0.0
+        self.maps = self.load_map_pool()
+        self.start_transition(self.maps.default_id())
         self.npc_move_count = 0
         return True
         # except Exception as e:
@@ -438,11 +709,13 @@ class Game:
             self.change_screen((event.w, event.h))
         if event.type == pygame.QUIT:
             self.running = False
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3 and self.profiler:
+            self.show_profile = not self.show_profile
         if self.id == 0:
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
                     # left click
-                    self.check_interact('X', pygame.mouse.get_pos())
+                    self.check_interact('X', event.pos)
         else:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_w:
@@ -479,20 +752,21 @@ class Game:
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
                     # left click
-                    self.check_interact(self.pc.direction, pygame.mouse.get_pos())
+                    self.check_interact(self.pc.direction, event.pos)
                 if event.button == 3:
                     # right click
-                    self.check_interact(self.pc.direction, pygame.mouse.get_pos())
+                    self.check_interact(self.pc.direction, event.pos)
                 if event.button == 4:
                     # scroll up
-                    self.check_interact(self.pc.direction, pygame.mouse.get_pos())
+                    self.check_interact(self.pc.direction, event.pos)
                 if event.button == 5:
                     # scroll down
-                    self.check_interact(self.pc.direction, pygame.mouse.get_pos())
+                    self.check_interact(self.pc.direction, event.pos)
         return False
 
-    def check_interact(self, direction: str, mouse_loc: tuple = (0, 0)):
-        ''' Check the surrounding on Interact request to find item, to interact with
+    def check_interact(self, direction: str, mouse_loc: tuple = None):
+        ''' Check the surrounding on Interact request to find item, to interact with.
+        A click picks the nearest interactable under the mouse that the pc can reach, otherwise the nearest one in the facing cone is used
         :str direction: direction the player is facing (N, S, E, W)
         :tuple mouse_loc (optional): location of the mouse on OnClick
         :return: None        
@@ -500,15 +774,14 @@ class Game:
         if direction == 'X':
             self.check_menu(mouse_loc)
         else:
-            interaction_points = self.map.creatures + self.map.items
-            if direction == 'N':
-                interact_obj = self.pc.check_surroundings(interaction_points, 1, 0, True)
-            elif direction == 'S':
-                interact_obj = self.pc.check_surroundings(interaction_points, 1, 0, False)
-            elif direction == 'E':
-                interact_obj = self.pc.check_surroundings(interaction_points, 0, 1, False)
-            elif direction == 'W':
-                interact_obj = self.pc.check_surroundings(interaction_points, 0, 1, True)
+            interact_obj = None
+            if mouse_loc is not None:
+                reachable = [obj for distance, obj in self.map.get_interactables(self.pc.location, self.pc.size, INTERACT_RADIUS)]
+                clicked = [obj for distance, obj in self.map.get_interactables(self.map.camera.to_world(mouse_loc), (0, 0), CLICK_RADIUS) if obj in reachable]
+                interact_obj = clicked[0] if clicked else None
+            if interact_obj is None:
+                in_front = self.map.get_interactables(self.pc.location, self.pc.size, INTERACT_RADIUS, direction, INTERACT_CONE)
+                interact_obj = in_front[0][1] if in_front else None
             if not interact_obj:
                 self.open_dialog('Hmmm... nothing to see here...')
             else:
@@ -517,24 +790,14 @@ class Game:
                     self.pc.is_talking = not self.pc.is_talking
     
     def check_menu(self, loc):
-        ''' Check the event against a map menu and fire the appropriate function
+        ''' Check the event against a map menu and fire the appropriate function. The click is looked up in the map's clickable index
+        and each portal under it runs its precompiled action
         :tuple mouse_loc: location of the mouse on OnClick
         :return: None        
         '''
-        adjusted_location = (((self.map.dimensions[0] // 2) - (self.screen_size[0] // 2)), ((self.map.dimensions[1] // 2) - (self.screen_size[1] // 2)))
-        for p in self.map.portals:
-            if p.location[0] < loc[0] + adjusted_location[0] < p.location[0] + p.size[0] and p.location[1] < loc[1] + adjusted_location[1] < p.location[1] + p.size[1]:
-                if str(p.dest_id)[:5] == '44444':
-                    self.delete_game(int(str(p.dest_id)[-1]))
-                elif p.dest_id == 55555:
-                    self.new_game()
-                elif str(p.dest_id)[:5] == '66666':
-                    self.load_game(int(str(p.dest_id)[-1]))
-                else:
-                    self.fade_out = True
-                    self.transition_map = self.load_map(p.get_map())
-                
-
+        for p in self.map.hit_test(loc):
+            action, args = p.action
+            getattr(self, action)(*args)
 
     def open_inventory(self):
         ''' Toggles the inventory screen
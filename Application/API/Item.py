@@ -1,7 +1,7 @@
-import pygame
 import os
+from . import Persistence, SpriteCache
 
-class Item:
+class Item(Persistence.Persisted):
     """ Parent class for all items.
     :int id: item ID
     :int map_id: id of home map
@@ -14,6 +14,9 @@ class Item:
     :bool inventoried: whether the item is inventoried
     :return: None
     """
+    table = 'Items'
+    persisted = {'map_id': 'MapID', 'location': Persistence.LOCATION, 'inventoried': 'Inventoried'}
+
     def __init__(self, id: int, directory: str, map_id: int, location: list, size: tuple, name: str, type: str, desc: str, rarity: str, value: int, inventoried: bool = False):
         self.id = id
         self.directory = directory
@@ -27,25 +30,19 @@ class Item:
         self.value = value
         self.icons = self.load_images()
         self.icon = self.icons[0]
-        self.inv_icon = pygame.image.load(os.path.join(self.directory, f'Resources/{name}_inv.png')).convert_alpha()
+        self.inv_icon = SpriteCache.sprites.load(os.path.join(self.directory, f'Resources/{name}_inv.png'))
         self.inventoried = inventoried
 
     def load_images(self):
-        image_arr = [pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}1.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}2.png')).convert_alpha(),
-            pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}3.png')).convert_alpha(),pygame.image.load(os.path.join(self.directory, f'Resources/{self.name}2.png')).convert_alpha()]
-
-        return image_arr
-
-    def animate(self, fps, move_count):
-        if 0 <= move_count % fps < 15:
-            self.icon = self.icons[0]
-        elif 15 <= move_count % fps < 30:
-            self.icon = self.icons[1]
-        elif 30 <= move_count % fps < 45:
-            self.icon = self.icons[2]
-        else:
-            self.icon = self.icons[3]
+        return SpriteCache.sprites.load_frames(self.directory, self.name)
 
+    def animate(self, rate, ticks):
+        ''' picks the sprite for a point in simulation time. The four frames loop once per simulated second, whatever the frame rate
+        :int rate: simulation ticks per second
+        :int ticks: simulation ticks elapsed
+        :return: None
+        '''
+        self.icon = self.icons[(ticks % rate) * 4 // rate]
 
 class Tool(Item):
     """ Sub class for a Tool
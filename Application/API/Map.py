@@ -1,6 +1,6 @@
-import pygame
 import os
-from . import Item, Creature
+import math
+from . import Item, Creature, Camera, Collision, MapImage, NPCBatch, Persistence, SpatialIndex
 
 class Block:
     def __init__(self, id: int, location: tuple, size: tuple):
@@ -8,12 +8,32 @@ class Block:
         self.location = location
         self.size = size
 
+MENU_ACTIONS = {'44444': 'delete_game', '55555': 'new_game', '66666': 'load_game'}
+
+def compile_action(dest_id: int):
+    """ decodes a portal's destination ID into the Game method a click on it calls. Menu buttons use special IDs:
+    44444n deletes save slot n, 55555 starts a new game and 66666n loads save slot n. Any other ID is a map to transition to
+    :int dest_id: portal destination ID
+    :return: tuple (str Game method name, tuple arguments)
+    """
+    code = str(dest_id)
+    action = MENU_ACTIONS.get(code[:5])
+    if action == 'new_game' and code == '55555':
+        return action, ()
+    if action in ('delete_game', 'load_game'):
+        return action, (int(code[-1]),)
+    return 'start_transition', (dest_id,)
+
 class Portal:
+    """ A doorway to another map, or a menu button
+    :tuple action: Game method a click on the portal calls and its arguments, decoded once from dest_id (see compile_action)
+    """
     def __init__(self, map_id: int, location: tuple, size: tuple, dest_id: int):
         self.map_id = map_id
         self.location = location
         self.size = size
         self.dest_id = dest_id
+        self.action = compile_action(dest_id)
 
     def get_map(self):
         return self.dest_id
@@ -24,47 +44,243 @@ class Map:
     :int game_id (input): the game the map is attached to
     :str directory (input): the game directory
     :str image (input): the filepath for the main map image
-    :list location (input): the render coordinates for the map
+    :list location (input): the render coordinates for the map (the camera offset)
     :str type (input): the type of map (static, dynamic, sidescroll)
     :list pc_start (input): the coordinates for the pc's starting position
+    :obj image: map image backend (MapImage.WholeImage, or MapImage.ChunkedImage for large scrolling maps)
     :list dimensions: the width and height of the map
     :list items: all items to be rendered on the map
     :list blocks: all impassable areas on the map
     :list creatures: all creatures to be rendered on the map
+    :obj camera: view offset for the map. Items, blocks, creatures and portals stay in world coordinates
+    :obj spatial: spatial hash of every blocker on the map (items, blocks, creatures, monsters and portals)
+    :obj clickables: spatial hash of the map's clickable regions (portals and menu buttons) for hit-testing clicks
+    :obj broadphase: sort-and-sweep pairs of creatures, monsters and the pc that may touch this tick (see update_broadphase)
+    :int nav_version: bumped whenever the blocks change so navigation grids and cached paths are rebuilt
+    :obj npc_batch: NPCBatch.NPCBatch running every NPC's wander cycle at once, or None when each NPC runs its own (see batch_creatures)
+    :obj static: collision backend the blocks are checked with instead of the spatial hash (Collision.BlockerArrays or Collision.CollisionMask), or None
+    :dict preloaded (input): image, rows and item types read ahead by the map prefetcher (optional: default None)
     """
-    def __init__(self, dbconn, id: int, game_id: int, directory: str, image: str, location: list, type: str, pc_start: list):
+    def __init__(self, dbconn, id: int, game_id: int, directory: str, image: str, location: list, type: str, pc_start: list, preloaded: dict = None):
         self.dbconn = dbconn
+        self.preloaded = preloaded
         self.id = id
         self.game_id = game_id
         self.directory = directory
         self.image_str = image
-        self.image = pygame.image.load(os.path.join(self.directory, f'Resources/{image}')).convert()
-        self.location = location
+        self.camera = Camera.Camera(location)
         self.type = type
         self.pc_start = pc_start
-        self.dimensions = [self.image.get_width(), self.image.get_height()]
+        self.image = None
+        self.load_image(preloaded.get('image') if preloaded else None)
+        self.dimensions = [self.image.width, self.image.height]
         self.items = self.load_items()
         self.blocks = self.load_blocks()
         self.creatures = self.load_creatures()
         self.monsters = self.load_monsters()
         self.portals = self.load_portals()
+        self.static = None
+        self.nav_version = 0
+        self.npc_batch = None
+        self.spatial = self.build_index()
+        self.clickables = self.build_clickables()
+        self.broadphase = SpatialIndex.SweepAndPrune()
+        self.preloaded = None
+
+    def load_image(self, preloaded=None):
+        ''' decodes the map image (or opens its tile cache) if it isn't loaded
+        :preloaded: image prepared by MapImage.preload_image (optional: default None)
+        :return: None
+        '''
+        if self.image is None:
+            self.image = MapImage.open_image(os.path.join(self.directory, f'Resources/{self.image_str}'), os.path.join(self.directory, 'Cache/MapTiles'), self.type, preloaded)
+
+    def get_rows(self, table: str):
+        ''' get the rows for everything of one type on the map, from the prefetched bundle if there is one
+        :str table: table name
+        :return: list rows
+        '''
+        if self.preloaded and 'rows' in self.preloaded:
+            return self.preloaded['rows'][table]
+        return self.dbconn.get_associated_items(table, 'MapID', self.id)
+
+    def get_item_type(self, type_id: int):
+        ''' get an ItemTypes row, from the prefetched bundle if there is one
+        :int type_id: item type ID
+        :return: tuple row
+        '''
+        if self.preloaded and 'item_types' in self.preloaded:
+            return self.preloaded['item_types'][type_id]
+        return self.dbconn.get_row_by_id('ItemTypes', type_id)
+
+    def build_index(self):
+        ''' indexes every blocker on the map. Insertion order sets which blocker wins when several are hit at once
+        :return: obj SpatialIndex.SpatialHash
+        '''
+        spatial = SpatialIndex.SpatialHash()
+        blocks = self.blocks if self.static is None else []
+        for obj in self.items + blocks + self.creatures + self.monsters + self.portals:
+            spatial.insert(obj)
+        return spatial
+
+    def build_clickables(self):
+        ''' indexes the regions a click can land on. They never move, so the index is built once
+        :return: obj SpatialIndex.SpatialHash
+        '''
+        clickables = SpatialIndex.SpatialHash()
+        for portal in self.portals:
+            clickables.insert(portal)
+        return clickables
+
+    def hit_test(self, point: tuple):
+        ''' get the clickable regions under a point on the screen
+        :tuple point: screen coordinates (e.g. a mouse click)
+        :return: list Portals, in load order
+        '''
+        return self.clickables.at(self.camera.to_world(point))
+
+    def use_static(self, backend):
+        ''' checks the blocks with a collision backend instead of the spatial hash
+        :obj backend: Collision.BlockerArrays or Collision.CollisionMask
+        :return: None
+        '''
+        if self.static is None:
+            for block in self.blocks:
+                self.spatial.remove(block)
+        self.static = backend
+
+    def vectorize_blocks(self):
+        ''' checks the blocks as a numpy structure of arrays. Does nothing without numpy
+        :return: bool whether the blocks are vectorized
+        '''
+        if not isinstance(self.static, Collision.BlockerArrays) and Collision.BlockerArrays.available():
+            self.use_static(Collision.BlockerArrays(self.blocks))
+        return isinstance(self.static, Collision.BlockerArrays)
+
+    def compile_collision(self):
+        ''' checks the blocks (and the companion collision image, if there is one) through a precompiled collision mask
+        :return: obj Collision.CollisionMask
+        '''
+        if not isinstance(self.static, Collision.CollisionMask):
+            self.use_static(Collision.CollisionMask(self.blocks, self.dimensions, os.path.join(self.directory, f'Resources/{self.image_str}'), os.path.join(self.directory, 'Cache/CollisionMasks'), f'map_{self.id}'))
+        return self.static
+
+    def batch_creatures(self, fps: int):
+        ''' runs the NPCs through a numpy structure of arrays instead of one NPC.action call each. Does nothing without numpy
+        :int fps: simulation ticks per second
+        :return: bool whether the NPCs are batched
+        '''
+        if self.npc_batch is None and NPCBatch.NPCBatch.available():
+            self.npc_batch = NPCBatch.NPCBatch(self.creatures, fps)
+        return self.npc_batch is not None
+
+    def set_blocks(self, blocks: list):
+        ''' replaces the map's blocks, rebuilding whichever collision backend they were checked with
+        :list blocks: new blocks
+        :return: None
+        '''
+        backend = type(self.static)
+        for block in self.blocks:
+            self.spatial.remove(block)
+        self.blocks = list(blocks)
+        self.static = None
+        for block in self.blocks:
+            self.spatial.insert(block)
+        if backend is Collision.CollisionMask:
+            self.compile_collision()
+        elif backend is Collision.BlockerArrays:
+            self.vectorize_blocks()
+        self.nav_version += 1
+
+    def get_blockers(self, location: list, size: tuple, margin: float):
+        ''' get the blockers near a rect, e.g. everything the pc could touch this tick
+        :list location: world coordinates of the top left corner (float x, float y)
+        :tuple size: width and height of the rect
+        :float margin: distance to grow the rect by on every side
+        :return: list blockers
+        '''
+        return self.spatial.query(location[0] - margin, location[1] - margin, size[0] + margin * 2, size[1] + margin * 2)
+
+    def update_broadphase(self, pc=None):
+        ''' pairs up the creatures, monsters and pc that may touch this tick
+        :obj pc: main character (optional: default None)
+        :return: int number of candidate pairs
+        '''
+        bodies = self.creatures + self.monsters
+        if pc is not None:
+            bodies = bodies + [pc]
+        return self.broadphase.update(bodies)
+
+    def get_movement_blockers(self, body, velocity: tuple):
+        ''' get everything a moving body may hit this tick: its broadphase neighbours, then the nearby blockers from the spatial hash
+        (creatures and monsters come from the broadphase only, if the body was in its last update)
+        :obj body: creature or pc that is moving
+        :tuple velocity: its movement this tick (float x, float y)
+        :return: list blockers
+        '''
+        nearby = self.get_blockers(body.location, body.size, max(abs(velocity[0]), abs(velocity[1])))
+        if body not in self.broadphase.neighbours:
+            return [b for b in nearby if b is not body]
+        return self.broadphase.get_neighbours(body) + [b for b in nearby if b not in self.broadphase.neighbours]
+
+    def get_interactables(self, location: list, size: tuple, radius: float, facing: str = None, cone: float = 90):
+        ''' get the items, creatures and monsters within reach of a rect, nearest first
+        :list location: world coordinates of the top left corner (float x, float y)
+        :tuple size: width and height of the rect (0, 0 for a point, e.g. a mouse click)
+        :float radius: largest gap between the rect and an interactable
+        :str facing: only keep things in front of the rect, N, S, E or W (optional: default None, any direction)
+        :float cone: width of the facing cone in degrees (optional: default 90)
+        :return: list of tuple (float distance, object)
+        '''
+        found = self.spatial.nearest(location, size, radius, lambda obj: isinstance(obj, (Item.Item, Creature.NPC)))
+        if facing is None:
+            return found
+        aim = {'N': (0, -1), 'S': (0, 1), 'W': (-1, 0), 'E': (1, 0)}[facing]
+        center = (location[0] + size[0] / 2, location[1] + size[1] / 2)
+        min_cos = math.cos(math.radians(cone / 2))
+        in_front = []
+        for distance, obj in found:
+            dx = min(max(center[0], obj.location[0]), obj.location[0] + obj.size[0]) - center[0]
+            dy = min(max(center[1], obj.location[1]), obj.location[1] + obj.size[1]) - center[1]
+            length = math.hypot(dx, dy)
+            if length == 0 or (dx * aim[0] + dy * aim[1]) / length >= min_cos:
+                in_front.append((distance, obj))
+        return in_front
+
+    def remove_inventoried(self):
+        ''' drops the items that were picked up from the map and its index
+        :return: None
+        '''
+        remaining = []
+        for item in self.items:
+            if item.inventoried:
+                self.spatial.remove(item)
+            else:
+                remaining.append(item)
+        self.items = remaining
+
+    def unload_image(self):
+        ''' releases the map image. Everything else on the map is kept
+        :return: None
+        '''
+        self.image = None
 
     def load_monsters(self):
         ''' load all monsters on the map
         :return: list monsters
         '''
-        monster_list = self.dbconn.get_associated_items('Monsters', 'MapID', self.id)
+        monster_list = self.get_rows('Monsters')
         formatted_list = []
         for c in monster_list:
-            coords = [float(c[2].split(', ')[0]), float(c[2].split(', ')[1])]
-            size = (int(c[3].split(', ')[0]), int(c[3].split(', ')[1]))
+            coords = Persistence.read_numbers(c, Persistence.LOCATION)
+            size = tuple(Persistence.read_numbers(c, Persistence.SIZE, int))
             speed = float(c[4])
-            bounds = [int(c[6].split(', ')[0]), int(c[6].split(', ')[1]), int(c[6].split(', ')[2]), int(c[6].split(', ')[3])]
-            move_range = [int(c[7].split(', ')[0]), int(c[7].split(', ')[1])]
+            bounds = Persistence.read_numbers(c, Persistence.BOUNDS, int)
+            move_range = Persistence.read_numbers(c, Persistence.MOVE_RANGE, int)
             actions = c[9].split(', ')
             talk = False if c[8] == 0 else True
             monster = Creature.Monster(self.directory, c[0], c[1], coords, size, speed, c[5], actions, bounds, move_range, talk, 
-                                        c[10], c[11], c[12], c[13], c[14], c[15], c[16], c[17], c[18], c[19], c[20], c[21], c[22], c[23], c[24], c[25], [])
+                                        c[10], c[11], c[12], c[13], c[14], c[15], c[16], c[17], c[18], c[19], c[20], c[21], c[22], c[23], c[24], [])
             formatted_list.append(monster)
         return formatted_list
 
@@ -72,14 +288,14 @@ class Map:
         ''' load all creatures on the map
         :return: list creatures
         '''
-        creature_list = self.dbconn.get_associated_items('NPCs', 'MapID', self.id)
+        creature_list = self.get_rows('NPCs')
         formatted_list = []
         for c in creature_list:
-            coords = [float(c[2].split(', ')[0]), float(c[2].split(', ')[1])]
-            size = (int(c[3].split(', ')[0]), int(c[3].split(', ')[1]))
+            coords = Persistence.read_numbers(c, Persistence.LOCATION)
+            size = tuple(Persistence.read_numbers(c, Persistence.SIZE, int))
             speed = float(c[4])
-            bounds = [int(c[6].split(', ')[0]), int(c[6].split(', ')[1]), int(c[6].split(', ')[2]), int(c[6].split(', ')[3])]
-            move_range = [int(c[7].split(', ')[0]), int(c[7].split(', ')[1])]
+            bounds = Persistence.read_numbers(c, Persistence.BOUNDS, int)
+            move_range = Persistence.read_numbers(c, Persistence.MOVE_RANGE, int)
             actions = c[9].split(', ')
             talk = False if c[8] == 0 else True
             creature = Creature.NPC(self.directory, c[0], c[1], coords, size, speed, c[5], actions, bounds, move_range, talk)
@@ -90,12 +306,12 @@ class Map:
         ''' load all items on the map
         :return: list items
         '''
-        item_list = self.dbconn.get_associated_items('Items', 'MapID', self.id)
+        item_list = self.get_rows('Items')
         formatted_list = []
         for i in item_list:
-            item_type = self.dbconn.get_row_by_id('ItemTypes', i[6])
-            coords = [float(i[2].split(', ')[0]), float(i[2].split(', ')[1])]
-            size = (int(i[3].split(', ')[0]), int(i[3].split(', ')[1]))
+            item_type = (i.Type, i.TypeName, i.Description, i.Rarity, i.Value) if hasattr(i, 'TypeName') else self.get_item_type(i[6])
+            coords = Persistence.read_numbers(i, Persistence.LOCATION)
+            size = tuple(Persistence.read_numbers(i, Persistence.SIZE, int))
             inv = False if i[4] == 0 else True
             item = Item.Item(i[0], self.directory, i[1], coords, size, i[5], item_type[1], item_type[2], item_type[3], item_type[4], inv)
             if not inv:
@@ -107,40 +323,27 @@ class Map:
         ''' load all blocks on the map
         :return: list blocks
         '''
-        block_list = self.dbconn.get_associated_items('Blocks', 'MapID', self.id)
+        block_list = self.get_rows('Blocks')
         formatted_list = []
         for b in block_list:
-            coords = [float(b[2].split(', ')[0]), float(b[2].split(', ')[1])]
-            size = (int(b[3].split(', ')[0]), int(b[3].split(', ')[1]))
+            coords = Persistence.read_numbers(b, Persistence.LOCATION)
+            size = tuple(Persistence.read_numbers(b, Persistence.SIZE, int))
             formatted_list.append(Block(b[0], coords, size))
         return formatted_list
     
     def load_portals(self):
-        portal_list = self.dbconn.get_associated_items('Portals', 'MapID', self.id)
+        portal_list = self.get_rows('Portals')
         formatted_list = []
         for p in portal_list:
-            coords = [float(p[2].split(', ')[0]), float(p[2].split(', ')[1])]
-            size = (int(p[3].split(', ')[0]), int(p[3].split(', ')[1]))
+            coords = Persistence.read_numbers(p, Persistence.LOCATION)
+            size = tuple(Persistence.read_numbers(p, Persistence.SIZE, int))
             formatted_list.append(Portal(p[3], coords, size, p[4]))
         return formatted_list
 
-    def move(self, index: int, speed: float):
-        ''' move the map on player movement
-        :int index: whether the map will be moved along the x or y axis
-        :float speed: the speed at which the map will move
-        :return: None
-        '''
-        self.location[index] += speed
-        for item in self.items:
-            item.location[index] += speed
-        for block in self.blocks:
-            block.location[index] += speed
-        for creature in self.creatures:
-            creature.location[index] += speed
-            if index == 0:
-                creature.bounds[0] += speed
-                creature.bounds[1] += speed
-            elif index == 1:
-                creature.bounds[2] += speed
-                creature.bounds[3] += speed
-        
\ No newline at end of file
+    @property
+    def location(self):
+        return self.camera.offset
+
+    @location.setter
+    def location(self, location: list):
+        self.camera.offset = location
@@ -0,0 +1,199 @@
+import pygame
+import os
+import json
+import struct
+from collections import OrderedDict
+
+CHUNK_THRESHOLD = 2048 * 2048
+TILE_SIZE = 512
+TILE_BUDGET = 64 * 1024 * 1024
+
+def read_png_size(path: str):
+    """ reads the width and height of a png from its header without decoding the image
+    :str path: filepath to the png
+    :return: tuple (int width, int height) or None if the file is not a png
+    """
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+def open_image(path: str, cache_dir: str, type: str, preloaded=None):
+    """ picks the image backend for a map. Large scrolling maps are chunked, small or static maps are loaded whole
+    :str path: filepath to the map image
+    :str cache_dir: directory for preprocessed map tiles
+    :str type: the type of map (static, dynamic, sidescroll)
+    :preloaded: result of preload_image for this map, if it was prefetched (optional: default None)
+    :return: WholeImage or ChunkedImage
+    """
+    if isinstance(preloaded, ChunkedImage):
+        return preloaded
+    if preloaded is not None:
+        return WholeImage(path, preloaded)
+    size = read_png_size(path)
+    if type != 'static' and size and size[0] * size[1] >= CHUNK_THRESHOLD:
+        return ChunkedImage(path, cache_dir)
+    return WholeImage(path)
+
+def preload_image(path: str, cache_dir: str, type: str):
+    """ does the slow part of opening a map image without touching the display, so it can run off the main thread.
+    Chunked maps get their tile cache prepared, whole maps are decoded but not converted
+    :str path: filepath to the map image
+    :str cache_dir: directory for preprocessed map tiles
+    :str type: the type of map (static, dynamic, sidescroll)
+    :return: ChunkedImage or unconverted pygame Surface, to be passed to open_image
+    """
+    size = read_png_size(path)
+    if type != 'static' and size and size[0] * size[1] >= CHUNK_THRESHOLD:
+        return ChunkedImage(path, cache_dir)
+    return pygame.image.load(path)
+
+class WholeImage:
+    """ Map image decoded into a single converted surface (the default for small and static maps)
+    :str path (input): filepath to the map image
+    :object surface (input): already decoded, unconverted map image (optional: default None, decodes path)
+    :int width: width of the map image
+    :int height: height of the map image
+    """
+    def __init__(self, path: str, surface=None):
+        self.path = path
+        self.surface = (surface if surface is not None else pygame.image.load(path)).convert()
+        self.width = self.surface.get_width()
+        self.height = self.surface.get_height()
+
+    def draw(self, screen, offset: list):
+        ''' blits the map image onto the screen
+        :object screen: main game screen
+        :list offset: screen coordinates of the map's top left corner
+        :return: None
+        '''
+        screen.blit(self.surface, (offset[0], offset[1]))
+
+    def get_bytes(self):
+        ''' size of the decoded image in memory
+        :return: int bytes
+        '''
+        return self.surface.get_pitch() * self.height
+
+class ChunkedImage:
+    """ Map image split into fixed-size tiles stored in an on-disk cache. Only the tiles near the camera are decoded,
+    and the least recently used tiles are dropped once the budget is exceeded
+    :str path (input): filepath to the map image
+    :str cache_dir (input): directory for preprocessed map tiles
+    :int tile_size (input): width and height of a tile in pixels (optional: default TILE_SIZE)
+    :int budget (input): maximum bytes of decoded tiles to keep (optional: default TILE_BUDGET)
+    :int width: width of the map image
+    :int height: height of the map image
+    :OrderedDict tiles: decoded tiles keyed by (column, row), least recently used first
+    """
+    def __init__(self, path: str, cache_dir: str, tile_size: int = TILE_SIZE, budget: int = TILE_BUDGET):
+        self.path = path
+        self.tile_size = tile_size
+        self.budget = budget
+        stat = os.stat(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        self.tile_dir = os.path.join(cache_dir, f'{name}_{int(stat.st_mtime)}_{stat.st_size}_{tile_size}')
+        self.width, self.height = self.prepare()
+        self.columns = -(-self.width // tile_size)
+        self.rows = -(-self.height // tile_size)
+        self.tiles = OrderedDict()
+        self.tile_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def prepare(self):
+        ''' makes sure the tile cache for the image exists, splitting the image the first time it is seen
+        :return: tuple (int width, int height)
+        '''
+        manifest_path = os.path.join(self.tile_dir, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            return manifest['width'], manifest['height']
+        os.makedirs(self.tile_dir, exist_ok=True)
+        image = pygame.image.load(self.path)
+        width, height = image.get_size()
+        for col in range(-(-width // self.tile_size)):
+            for row in range(-(-height // self.tile_size)):
+                area = pygame.Rect(col * self.tile_size, row * self.tile_size, self.tile_size, self.tile_size).clip(image.get_rect())
+                pygame.image.save(image.subsurface(area), self.tile_path(col, row))
+        with open(manifest_path, 'w') as f:
+            json.dump({'width': width, 'height': height, 'tile_size': self.tile_size}, f)
+        return width, height
+
+    def tile_path(self, col: int, row: int):
+        return os.path.join(self.tile_dir, f'{col}_{row}.png')
+
+    def get_tile(self, col: int, row: int):
+        ''' returns a decoded tile, loading it from the tile cache if necessary
+        :int col: tile column
+        :int row: tile row
+        :return: pygame Surface
+        '''
+        key = (col, row)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return tile
+        self.misses += 1
+        tile = pygame.image.load(self.tile_path(col, row)).convert()
+        self.tiles[key] = tile
+        self.tile_bytes += tile.get_pitch() * tile.get_height()
+        return tile
+
+    def tile_range(self, rect):
+        ''' columns and rows of the tiles overlapping a rect in image coordinates
+        :object rect: pygame Rect in image coordinates
+        :return: tuple (range columns, range rows)
+        '''
+        first_col = max(0, rect.left // self.tile_size)
+        last_col = min(self.columns - 1, (rect.right - 1) // self.tile_size)
+        first_row = max(0, rect.top // self.tile_size)
+        last_row = min(self.rows - 1, (rect.bottom - 1) // self.tile_size)
+        return range(first_col, last_col + 1), range(first_row, last_row + 1)
+
+    def draw(self, screen, offset: list):
+        ''' blits the tiles under the screen's clip area, prefetches one neighbouring tile and evicts old ones
+        :object screen: main game screen
+        :list offset: screen coordinates of the map's top left corner
+        :return: None
+        '''
+        ox = int(offset[0])
+        oy = int(offset[1])
+        view = screen.get_clip().move(-ox, -oy)
+        cols, rows = self.tile_range(view)
+        in_use = set()
+        for col in cols:
+            for row in rows:
+                screen.blit(self.get_tile(col, row), (ox + col * self.tile_size, oy + row * self.tile_size))
+                in_use.add((col, row))
+        near_cols, near_rows = self.tile_range(view.inflate(self.tile_size * 2, self.tile_size * 2))
+        prefetched = False
+        for col in near_cols:
+            for row in near_rows:
+                if not prefetched and (col, row) not in self.tiles and self.tile_bytes < self.budget:
+                    self.get_tile(col, row)
+                    prefetched = True
+                in_use.add((col, row))
+        self.evict(in_use)
+
+    def evict(self, keep: set):
+        ''' drops least recently used tiles until the decoded tiles fit in the budget
+        :set keep: tiles that must stay loaded (on or near the screen)
+        :return: None
+        '''
+        for key in list(self.tiles.keys()):
+            if self.tile_bytes <= self.budget:
+                break
+            if key in keep:
+                continue
+            tile = self.tiles.pop(key)
+            self.tile_bytes -= tile.get_pitch() * tile.get_height()
+
+    def get_bytes(self):
+        ''' size of the decoded tiles in memory
+        :return: int bytes
+        '''
+        return self.tile_bytes
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from . import Map, Persistence
+
+class MapPool:
+    """ Builds a game's maps the first time they are entered and keeps a bounded number of map images decoded.
+    Evicted maps only drop their image, so their items, creatures and camera keep their state and re-entry is cheap
+    :obj dbconn (input): main game db connection object
+    :int game_id (input): the game the maps are attached to
+    :str directory (input): the game directory
+    :int max_loaded (input): maximum number of maps with a decoded image (optional: default 3)
+    :int memory_limit (input): maximum bytes of decoded map images (optional: default 256 MB)
+    :obj prefetcher (input): background map prefetcher (optional: default None, maps are always built synchronously)
+    :obj world (input): WorldLoader that reads the rows of every map of the game up front (optional: default None, each map queries its own rows)
+    :dict rows: Maps table rows for the game keyed by map ID
+    :dict bundles: rows read by the world loader for the maps not built yet, keyed by map ID
+    :dict maps: every map built so far keyed by map ID
+    :OrderedDict loaded: maps with a decoded image keyed by map ID, least recently used first
+    """
+    def __init__(self, dbconn, game_id: int, directory: str, max_loaded: int = 3, memory_limit: int = 256 * 1024 * 1024, prefetcher=None, world=None):
+        self.dbconn = dbconn
+        self.prefetcher = prefetcher
+        self.game_id = game_id
+        self.directory = directory
+        self.max_loaded = max_loaded
+        self.memory_limit = memory_limit
+        self.rows = {m[0]: m for m in self.dbconn.get_associated_items('Maps', 'GameID', game_id)}
+        self.bundles = world.load_game(game_id, list(self.rows)) if world else {}
+        self.maps = {}
+        self.loaded = OrderedDict()
+        self.builds = 0
+        self.evictions = 0
+
+    def __iter__(self):
+        return iter(list(self.maps.values()))
+
+    def __contains__(self, map_id):
+        return map_id in self.maps
+
+    def default_id(self):
+        """ get the ID of the map the game starts on
+        :return: int map ID or None
+        """
+        for m in self.rows.values():
+            if m[6] == 1:
+                return m[0]
+        return None
+
+    def build(self, map_id: int, preloaded: dict = None):
+        """ instantiates a map and everything on it from its Maps row
+        :int map_id: map ID
+        :dict preloaded: bundle read ahead by the prefetcher (optional: default None)
+        :return: object Map
+        """
+        m = self.rows[map_id]
+        if map_id in self.bundles:
+            preloaded = dict(preloaded or {}, **self.bundles.pop(map_id))
+        coords = Persistence.read_numbers(m, Persistence.COORDINATES)
+        pc_start = Persistence.read_numbers(m, Persistence.PC_START, int)
+        self.builds += 1
+        return Map.Map(self.dbconn, m[0], m[1], self.directory, m[2], coords, m[4], pc_start, preloaded)
+
+    def get(self, map_id: int, keep: int = None):
+        """ returns a map ready to be drawn, building it or reloading its image if necessary
+        :int map_id: map ID
+        :int keep: ID of a map that must not be evicted, usually the one on screen (optional: default None)
+        :return: object Map or None if the map doesn't belong to the game
+        """
+        if map_id not in self.rows:
+            return None
+        bundle = self.prefetcher.take(map_id) if self.prefetcher else None
+        map = self.maps.get(map_id)
+        if map is None:
+            map = self.build(map_id, bundle)
+            self.maps[map_id] = map
+        map.load_image(bundle.get('image') if bundle else None)
+        self.loaded[map_id] = map
+        self.loaded.move_to_end(map_id)
+        self.evict((map_id, keep))
+        return map
+
+    def prefetch(self, map_id: int):
+        """ starts warming a map in the background if it isn't ready to be drawn
+        :int map_id: map ID
+        :return: None
+        """
+        if not self.prefetcher or map_id not in self.rows or map_id in self.loaded:
+            return
+        m = self.rows[map_id]
+        self.prefetcher.request(map_id, m[2], m[4], map_id in self.maps or map_id in self.bundles)
+
+    def is_ready(self, map_id: int, wait: bool = False):
+        """ checks whether get() can return a map without waiting for the prefetcher
+        :int map_id: map ID
+        :bool wait: block until the prefetch finishes instead (optional: default False)
+        :return: bool ready
+        """
+        if map_id in self.loaded or not self.prefetcher:
+            return True
+        if wait:
+            self.prefetcher.wait(map_id)
+        return not self.prefetcher.is_pending(map_id)
+
+    def get_bytes(self):
+        """ size of all decoded map images in memory
+        :return: int bytes
+        """
+        return sum(m.image.get_bytes() for m in self.loaded.values())
+
+    def evict(self, keep: tuple):
+        """ drops the images of least recently used maps until the pool fits its count and memory limits
+        :tuple keep: IDs of maps that must stay loaded
+        :return: None
+        """
+        for map_id in list(self.loaded.keys()):
+            if len(self.loaded) <= self.max_loaded and self.get_bytes() <= self.memory_limit:
+                break
+            if map_id in keep:
+                continue
+            self.loaded.pop(map_id).unload_image()
+            self.evictions += 1
+
+    def stats(self):
+        """ reports pool usage
+        :return: dict (built, loaded, bytes, builds, evictions)
+        """
+        return {
+            'built': len(self.maps),
+            'loaded': len(self.loaded),
+            'bytes': self.get_bytes(),
+            'builds': self.builds,
+            'evictions': self.evictions
+        }
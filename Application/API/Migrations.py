@@ -0,0 +1,80 @@
+from . import Persistence
+
+NUMERIC_COLUMNS = {
+    'Maps': [(Persistence.COORDINATES, 'REAL'), (Persistence.PC_START, 'INTEGER')],
+    'Items': [(Persistence.LOCATION, 'REAL'), (Persistence.SIZE, 'INTEGER')],
+    'Blocks': [(Persistence.LOCATION, 'REAL'), (Persistence.SIZE, 'INTEGER')],
+    'Portals': [(Persistence.LOCATION, 'REAL'), (Persistence.SIZE, 'INTEGER')],
+    'NPCs': [(Persistence.LOCATION, 'REAL'), (Persistence.SIZE, 'INTEGER'), (Persistence.BOUNDS, 'INTEGER'), (Persistence.MOVE_RANGE, 'INTEGER')],
+    'Monsters': [(Persistence.LOCATION, 'REAL'), (Persistence.SIZE, 'INTEGER'), (Persistence.BOUNDS, 'INTEGER'), (Persistence.MOVE_RANGE, 'INTEGER')],
+    'PC': [(Persistence.LOCATION, 'REAL'), (Persistence.SIZE, 'INTEGER')]
+}
+
+def parse(text, field: tuple, cast):
+    """ reads a legacy "x, y" text value into the numbers of a field
+    :text: text column value
+    :tuple field: legacy text column and numeric columns, e.g. Persistence.LOCATION
+    :type cast: float or int
+    :return: list numbers, or None if the text doesn't hold one per numeric column
+    """
+    try:
+        values = [cast(v) for v in str(text).split(', ')]
+    except ValueError:
+        return None
+    return values if len(values) == len(field[1]) else None
+
+def numeric_columns(table: str, row):
+    """ reads the numeric columns of a row in the legacy layout (e.g. one copied from template.db) from its text columns
+    :str table: table name
+    :namedtuple row: db row
+    :return: dict values keyed by numeric column. Fields whose text can't be read are left out
+    """
+    columns = {}
+    for field, type in NUMERIC_COLUMNS.get(table, []):
+        values = parse(getattr(row, field[0], None), field, float if type == 'REAL' else int)
+        if values:
+            columns.update(zip(field[1], values))
+    return columns
+
+def add_numeric_columns(dbconn):
+    """ version 1: adds numeric columns next to the "x, y" text columns and fills them from the text. The text columns are kept (and saved alongside) for older saves and tools
+    :obj dbconn: DBManager
+    :return: None
+    """
+    for table, fields in NUMERIC_COLUMNS.items():
+        existing = dbconn.get_colnames(table)
+        if not existing:
+            continue
+        for field, type in fields:
+            for column in field[1]:
+                if column not in existing:
+                    dbconn.add_column(table, column, type)
+        for field, type in fields:
+            cast = float if type == 'REAL' else int
+            rows = []
+            for row_id, text in dbconn.conn.execute(f'SELECT ROWID, {field[0]} FROM {table}').fetchall():
+                values = parse(text, field, cast)
+                if values:
+                    rows.append(tuple(values) + (row_id,))
+            sql = f'UPDATE {table} SET {", ".join(f"{c} = ?" for c in field[1])} WHERE ROWID = ?'
+            dbconn.conn.executemany(sql, rows)
+
+MIGRATIONS = [add_numeric_columns]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(dbconn, target: int = SCHEMA_VERSION):
+    """ brings a database up to a schema version. Each migration runs in its own transaction and bumps PRAGMA user_version,
+    so an interrupted run resumes from the last finished version
+    :obj dbconn: DBManager
+    :int target: schema version to migrate to (optional: default SCHEMA_VERSION)
+    :return: list versions applied
+    """
+    applied = []
+    version = dbconn.get_user_version()
+    while version < target:
+        with dbconn.transaction():
+            MIGRATIONS[version](dbconn)
+            version += 1
+            dbconn.set_user_version(version)
+        applied.append(version)
+    return applied
@@ -0,0 +1,240 @@
+from . import Collision
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DIRECTIONS = ['N', 'S', 'W', 'E', 'action']
+WANDER = [2, 3, 0, 1]
+
+class NPCBatch:
+    """ Structure-of-arrays copy of a map's NPCs that runs the NPC.action wander cycle for all of them at once with numpy.
+    Talking NPCs and NPCs following a path still go through NPC.action. Wandering NPCs are swept against the map's blocks, items and portals,
+    culled per NPC from arrays sorted by left edge that are only rebuilt when those change, and against the creatures, monsters and pc
+    the map's broadphase paired them with. Needs numpy; use NPCBatch.available() before building one
+    :list creatures (input): the map's NPCs
+    :int fps (input): simulation ticks per second
+    :int seed (input): seed for the direction picks, for reproducible headless runs (optional: default None)
+    :array x: left edges
+    :array y: top edges
+    :array moving: move flags, one column per direction (N, S, W, E)
+    :array icon_index: sprite animation counters
+    :array index_rate: sprite swap rates (Game.get_index_rate, computed once)
+    :dict index: array index of each creature
+    :tuple statics: left edge sorted arrays (x, y, w, h) of the map's blocks, items and portals, or None until first needed
+    :tuple statics_key: the map's nav_version and item count the statics were built from
+    """
+    def __init__(self, creatures: list, fps: int, seed: int = None):
+        self.creatures = list(creatures)
+        self.fps = fps
+        self.rng = numpy.random.default_rng(seed)
+        self.x = numpy.array([c.location[0] for c in self.creatures], dtype=numpy.float64)
+        self.y = numpy.array([c.location[1] for c in self.creatures], dtype=numpy.float64)
+        self.w = numpy.array([c.size[0] for c in self.creatures], dtype=numpy.float64)
+        self.h = numpy.array([c.size[1] for c in self.creatures], dtype=numpy.float64)
+        self.icon_w = numpy.array([c.icon.get_width() for c in self.creatures], dtype=numpy.float64)
+        self.icon_h = numpy.array([c.icon.get_height() for c in self.creatures], dtype=numpy.float64)
+        self.speed = numpy.array([c.speed for c in self.creatures], dtype=numpy.float64)
+        self.bounds = numpy.array([c.bounds for c in self.creatures], dtype=numpy.float64).reshape(-1, 4)
+        self.move_start = numpy.array([c.move_range[0] for c in self.creatures], dtype=numpy.int64)
+        self.move_end = numpy.array([c.move_range[1] for c in self.creatures], dtype=numpy.int64)
+        self.moving = numpy.array([[c.moveup, c.movedown, c.moveleft, c.moveright] for c in self.creatures], dtype=bool).reshape(-1, 4)
+        self.icon_index = numpy.array([c.icon_index for c in self.creatures], dtype=numpy.int64)
+        self.frames = numpy.array([len(c.icons['E']) for c in self.creatures], dtype=numpy.int64)
+        self.index_rate = numpy.array([max(1, fps // len(c.icons['E']) * int(1 / c.speed * 2)) for c in self.creatures], dtype=numpy.int64)
+        self.index = {c: i for i, c in enumerate(self.creatures)}
+        self.statics = None
+        self.statics_key = None
+        self.reach = 0.0
+
+    def __len__(self):
+        return len(self.creatures)
+
+    @staticmethod
+    def available():
+        return numpy is not None
+
+    def static_obstacles(self, map):
+        ''' get the map's blocks, items and portals as arrays sorted by left edge, rebuilding them only when the blocks change or an item is picked up
+        :obj map: the map the NPCs are on
+        :return: tuple of arrays (x, y, w, h)
+        '''
+        key = (map.nav_version, len(map.items))
+        if self.statics is None or key != self.statics_key:
+            rects = numpy.array([(o.location[0], o.location[1], o.size[0], o.size[1]) for o in map.blocks + map.items + map.portals], dtype=numpy.float64).reshape(-1, 4)
+            rects = rects[numpy.argsort(rects[:, 0], kind='stable')]
+            self.statics = (rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3])
+            self.statics_key = key
+            self.reach = float(rects[:, 2].max()) if len(rects) else 0.0
+        return self.statics
+
+    def static_candidates(self, movers, delta, vertical, map):
+        ''' pairs each moving NPC with the static obstacles whose left edge falls in its swept x range (binary searches of the sorted arrays)
+        :array movers: array indices of the moving NPCs
+        :array delta: their movement along their axis
+        :array vertical: whether each moves along y
+        :obj map: the map the NPCs are on
+        :return: tuple (array mover position of each pair, arrays x, y, w, h of the obstacle)
+        '''
+        sx, sy, sw, sh = self.static_obstacles(map)
+        low = self.x[movers] + numpy.where(vertical, 0, numpy.minimum(delta, 0))
+        high = self.x[movers] + self.w[movers] + numpy.where(vertical, 0, numpy.maximum(delta, 0))
+        first = numpy.searchsorted(sx, low - self.reach, side='right')
+        counts = numpy.maximum(numpy.searchsorted(sx, high, side='left') - first, 0)
+        pair = numpy.repeat(numpy.arange(len(movers)), counts)
+        obstacle = numpy.repeat(first - (numpy.cumsum(counts) - counts), counts) + numpy.arange(len(pair))
+        return pair, sx[obstacle], sy[obstacle], sw[obstacle], sh[obstacle]
+
+    def body_candidates(self, movers, step_x, step_y, map):
+        ''' pairs each moving NPC with the bodies the map's broadphase paired it with this tick (other NPCs, monsters and the pc), from the broadphase's links.
+        A batched NPC that is also moving this tick is grown to cover its whole move, so two NPCs never step into the same space
+        :array movers: array indices of the moving NPCs
+        :array step_x: movement of every batched NPC along x this tick
+        :array step_y: movement of every batched NPC along y this tick
+        :obj map: the map the NPCs are on
+        :return: tuple (array mover position of each pair, arrays x, y, w, h of the body)
+        '''
+        broadphase = map.broadphase
+        links = numpy.array(broadphase.links, dtype=numpy.int64).reshape(-1, 2)
+        # array index of every body in the broadphase, -1 for the ones that aren't batched (monsters, the pc)
+        slot = numpy.array([self.index.get(b, -1) for b in broadphase.order], dtype=numpy.int64)
+        # mover position of every array index, with a trailing -1 that slot's -1 lands on
+        position = numpy.full(len(self.creatures) + 1, -1, dtype=numpy.int64)
+        position[movers] = numpy.arange(len(movers))
+        body = numpy.concatenate((links[:, 0], links[:, 1]))
+        other = numpy.concatenate((links[:, 1], links[:, 0]))
+        pair = position[slot[body]]
+        keep = pair >= 0
+        pair, other = pair[keep], other[keep]
+        j = slot[other]
+        grow_x, grow_y = step_x[j], step_y[j]
+        x = numpy.where(j >= 0, self.x[j] + numpy.minimum(grow_x, 0), 0)
+        y = numpy.where(j >= 0, self.y[j] + numpy.minimum(grow_y, 0), 0)
+        w = numpy.where(j >= 0, self.w[j] + numpy.abs(grow_x), 0)
+        h = numpy.where(j >= 0, self.h[j] + numpy.abs(grow_y), 0)
+        loose = j < 0
+        if loose.any():
+            rest, which = numpy.unique(other[loose], return_inverse=True)
+            rects = numpy.array([(b.location[0], b.location[1], b.size[0], b.size[1]) for b in (broadphase.order[i] for i in rest.tolist())], dtype=numpy.float64).reshape(-1, 4)[which]
+            x[loose], y[loose], w[loose], h[loose] = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+        return pair, x, y, w, h
+
+    def sweep(self, movers, delta, vertical, map):
+        ''' vectorized single-axis Collision.move_and_slide over the culled candidates: shortens each move to CONTACT_SKIN before the first obstacle in its way,
+        and stops a move deeper into anything the NPC already overlaps
+        :array movers: array indices of the moving NPCs
+        :array delta: their movement along their axis
+        :array vertical: whether each moves along y
+        :obj map: the map the NPCs are on
+        :return: array allowed movement
+        '''
+        step_x = numpy.zeros(len(self.creatures))
+        step_y = numpy.zeros(len(self.creatures))
+        step_x[movers[~vertical]] = delta[~vertical]
+        step_y[movers[vertical]] = delta[vertical]
+        static = self.static_candidates(movers, delta, vertical, map)
+        bodies = self.body_candidates(movers, step_x, step_y, map)
+        pair = numpy.concatenate((static[0], bodies[0]))
+        ox, oy, ow, oh = (numpy.concatenate((static[n], bodies[n])) for n in range(1, 5))
+        if len(pair) == 0:
+            return delta
+        limit = numpy.abs(delta)
+        axis = vertical[pair]
+        start = numpy.where(vertical, self.y[movers], self.x[movers])[pair]
+        length = numpy.where(vertical, self.h[movers], self.w[movers])[pair]
+        cross = numpy.where(vertical, self.x[movers], self.y[movers])[pair]
+        cross_length = numpy.where(vertical, self.w[movers], self.h[movers])[pair]
+        low, size = numpy.where(axis, oy, ox), numpy.where(axis, oh, ow)
+        cross_low, cross_size = numpy.where(axis, ox, oy), numpy.where(axis, ow, oh)
+        move = delta[pair]
+        in_range = (cross < cross_low + cross_size) & (cross_low < cross + cross_length)
+        overlap = (start < low + size) & (low < start + length)
+        deeper = (low + size / 2 - start - length / 2) * move >= 0
+        gap = numpy.where(move > 0, low - (start + length), start - (low + size))
+        stop = numpy.where(in_range & overlap, numpy.where(deeper, 0, numpy.inf),
+                           numpy.where(in_range & (gap >= 0), numpy.maximum(gap - Collision.CONTACT_SKIN, 0), numpy.inf))
+        numpy.minimum.at(limit, pair, stop)
+        return numpy.sign(delta) * limit
+
+    def update(self, count: int, pc, map, camera, screen_size: tuple):
+        ''' runs one simulation tick of every NPC's wander/action cycle and animates the ones on screen
+        :int count: simulation ticks elapsed in the NPC movement cycle
+        :obj pc: main character, or None
+        :obj map: the map the NPCs are on
+        :obj camera: the map camera, for culling
+        :tuple screen_size: current screen size (int x, int y)
+        :return: list visible creatures
+        '''
+        if not self.creatures:
+            return []
+        active = numpy.array([not c.is_talking and c.path is None for c in self.creatures], dtype=bool)
+        visible = (self.x + camera.offset[0] < screen_size[0]) & (self.y + camera.offset[1] < screen_size[1]) & (self.x + camera.offset[0] + self.icon_w > 0) & (self.y + camera.offset[1] + self.icon_h > 0)
+        before = self.moving.copy()
+        direction = numpy.full(len(self.creatures), 4, dtype=numpy.int64)
+
+        # start of the cycle: pick a random direction that keeps the NPC inside its bounds
+        starting = active & (count == self.move_start)
+        if starting.any():
+            max_distance = self.speed * numpy.abs(self.move_end - self.move_start)
+            allowed = numpy.stack([self.x > self.bounds[:, 0] + max_distance, self.x < self.bounds[:, 1] - max_distance,
+                                    self.y > self.bounds[:, 2] + max_distance, self.y < self.bounds[:, 3] - max_distance], axis=1) & starting[:, None]
+            options = allowed.sum(axis=1)
+            pick = (self.rng.random(len(self.creatures)) * options).astype(numpy.int64)
+            choice = numpy.argmax(allowed.cumsum(axis=1) > pick[:, None], axis=1)
+            chosen = numpy.array(WANDER)[choice]
+            choosing = options > 0
+            self.moving[numpy.flatnonzero(choosing), chosen[choosing]] = True
+            direction[choosing] = chosen[choosing]
+
+        # middle of the cycle: walk in the first set direction, N before S before W before E
+        walking = active & (self.move_start < count) & (count <= self.move_end) & self.moving.any(axis=1)
+        if walking.any():
+            heading = numpy.argmax(self.moving, axis=1)
+            direction[walking] = heading[walking]
+            movers = numpy.flatnonzero(walking)
+            vertical = heading[movers] < 2
+            delta = numpy.where((heading[movers] == 0) | (heading[movers] == 2), 0 - self.speed[movers], self.speed[movers])
+            allowed = self.sweep(movers, delta, vertical, map)
+            # write the new positions back in one pass, and only move the ones that left their spatial hash cells
+            cell = map.spatial.cell_size
+            old_x, old_y = self.x[movers], self.y[movers]
+            self.y[movers[vertical]] += allowed[vertical]
+            self.x[movers[~vertical]] += allowed[~vertical]
+            new_x, new_y = self.x[movers], self.y[movers]
+            crossed = ((old_x // cell != new_x // cell) | ((old_x + self.w[movers]) // cell != (new_x + self.w[movers]) // cell)
+                        | (old_y // cell != new_y // cell) | ((old_y + self.h[movers]) // cell != (new_y + self.h[movers]) // cell))
+            creatures = self.creatures
+            for i, x, y in zip(movers.tolist(), new_x.tolist(), new_y.tolist()):
+                location = creatures[i].location
+                location[0] = x
+                location[1] = y
+            for i in movers[crossed].tolist():
+                map.spatial.update(creatures[i])
+
+        # end of the cycle: stop
+        resting = active & ~((self.move_start < count) & (count <= self.move_end)) & ~starting
+        self.moving[resting] = False
+
+        for i in numpy.flatnonzero((self.moving != before).any(axis=1)):
+            c = self.creatures[i]
+            c.moveup, c.movedown, c.moveleft, c.moveright = (bool(f) for f in self.moving[i])
+
+        # animate the NPCs on screen
+        animated = active & visible
+        self.icon_index[animated] += 1
+        self.icon_index[animated & (self.icon_index // self.index_rate == self.frames)] = 0
+        frame = self.icon_index // self.index_rate
+        for i in numpy.flatnonzero(animated):
+            creature = self.creatures[i]
+            creature.icon_index = int(self.icon_index[i])
+            creature.icon = creature.icons[DIRECTIONS[direction[i]]][frame[i]]
+
+        # talking and path following NPCs keep the per-object cycle
+        for i in numpy.flatnonzero(~active):
+            creature = self.creatures[i]
+            creature.action(self.fps, count, int(self.index_rate[i]), pc, bool(visible[i]), map)
+            self.x[i], self.y[i] = creature.location
+            self.icon_index[i] = creature.icon_index
+            self.moving[i] = (creature.moveup, creature.movedown, creature.moveleft, creature.moveright)
+            map.spatial.update(creature)
+        return [self.creatures[i] for i in numpy.flatnonzero(visible)]
@@ -0,0 +1,241 @@
+import heapq
+import math
+import time
+from collections import OrderedDict
+from . import Collision
+
+NAV_CELL = 32
+PATH_CACHE_SIZE = 256
+FRAME_BUDGET = 0.002
+EXPANSION_CHUNK = 64
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+class NavGrid:
+    """ Walkability grid of a map for one agent size. A cell is walkable if an agent with its top left corner on the cell's corner overlaps no block (blocks are rasterized onto the cells they rule out)
+    :list blocks (input): the map's blocks (anything with a location and size)
+    :tuple dimensions (input): the width and height of the map
+    :tuple agent_size (input): width and height of the agents that path on the grid
+    :int version (input): the map's nav_version the grid was built from
+    :obj mask (input): Collision.CollisionMask to also check the companion collision image (optional: default None)
+    :int cell_size (input): width and height of a cell in pixels (optional: default NAV_CELL)
+    :bytearray walkable: 1 for a walkable cell, indexed row * cols + col
+    """
+    def __init__(self, blocks: list, dimensions: tuple, agent_size: tuple, version: int, mask=None, cell_size: int = NAV_CELL):
+        self.cell_size = cell_size
+        self.agent_size = agent_size
+        self.version = version
+        self.cols = max(1, int(dimensions[0] - agent_size[0]) // cell_size + 1)
+        self.rows = max(1, int(dimensions[1] - agent_size[1]) // cell_size + 1)
+        self.walkable = bytearray(b'\x01') * (self.cols * self.rows)
+        w, h = agent_size
+        for b in blocks:
+            first_col = max(0, math.floor((b.location[0] - w) / cell_size) + 1)
+            last_col = min(self.cols - 1, math.ceil((b.location[0] + b.size[0]) / cell_size) - 1)
+            first_row = max(0, math.floor((b.location[1] - h) / cell_size) + 1)
+            last_row = min(self.rows - 1, math.ceil((b.location[1] + b.size[1]) / cell_size) - 1)
+            for row in range(first_row, last_row + 1):
+                start = row * self.cols
+                self.walkable[start + first_col:start + last_col + 1] = bytes(max(0, last_col - first_col + 1))
+        if mask is not None:
+            for row in range(self.rows):
+                for col in range(self.cols):
+                    if self.walkable[row * self.cols + col] and not mask.is_walkable((col * cell_size, row * cell_size), (w, h)):
+                        self.walkable[row * self.cols + col] = 0
+
+    def cell_of(self, point: list):
+        ''' get the cell a point falls in, clamped to the grid
+        :list point: world coordinates (float x, float y)
+        :return: tuple (int col, int row)
+        '''
+        col = min(max(int(point[0] // self.cell_size), 0), self.cols - 1)
+        row = min(max(int(point[1] // self.cell_size), 0), self.rows - 1)
+        return col, row
+
+    def point_of(self, cell: tuple):
+        ''' world coordinates of a cell's top left corner
+        :tuple cell: (int col, int row)
+        :return: list (float x, float y)
+        '''
+        return [float(cell[0] * self.cell_size), float(cell[1] * self.cell_size)]
+
+    def is_walkable(self, cell: tuple):
+        return 0 <= cell[0] < self.cols and 0 <= cell[1] < self.rows and self.walkable[cell[1] * self.cols + cell[0]] == 1
+
+class PathSearch:
+    """ A* search over a NavGrid (4-connected, manhattan heuristic) that can be paused and resumed between frames
+    :obj grid (input): navigation grid
+    :tuple start (input): start cell (int col, int row)
+    :tuple goal (input): goal cell (int col, int row)
+    :str status: pending, done or failed
+    :list path: cells from start to goal once done, else None
+    """
+    def __init__(self, grid: NavGrid, start: tuple, goal: tuple):
+        self.grid = grid
+        self.start = start
+        self.goal = goal
+        self.status = 'pending'
+        self.path = None
+        self.expanded = 0
+        self.open = [(self.heuristic(start), 0, start)]
+        self.came_from = {start: None}
+        self.cost = {start: 0}
+        self.counter = 1
+        if not grid.is_walkable(goal):
+            self.status = 'failed'
+
+    def heuristic(self, cell: tuple):
+        return abs(cell[0] - self.goal[0]) + abs(cell[1] - self.goal[1])
+
+    def run(self, limit: int):
+        ''' expands up to a number of nodes
+        :int limit: maximum node expansions before pausing
+        :return: str status
+        '''
+        for _ in range(limit):
+            if self.status != 'pending':
+                break
+            if not self.open:
+                self.status = 'failed'
+                break
+            cell = heapq.heappop(self.open)[2]
+            self.expanded += 1
+            if cell == self.goal:
+                self.status = 'done'
+                self.path = self.rebuild(cell)
+                break
+            cost = self.cost[cell] + 1
+            for dx, dy in NEIGHBOURS:
+                next_cell = (cell[0] + dx, cell[1] + dy)
+                if cost < self.cost.get(next_cell, cost + 1) and self.grid.is_walkable(next_cell):
+                    self.cost[next_cell] = cost
+                    self.came_from[next_cell] = cell
+                    heapq.heappush(self.open, (cost + self.heuristic(next_cell), self.counter, next_cell))
+                    self.counter += 1
+        return self.status
+
+    def rebuild(self, cell: tuple):
+        path = []
+        while cell is not None:
+            path.append(cell)
+            cell = self.came_from[cell]
+        path.reverse()
+        return path
+
+class PathRequest:
+    """ Handle for a queued path query. Poll status, or read waypoints once it is done. Agents asking for the same path while it is
+    pending share one request, so waypoints are read only (each agent keeps its own cursor into them)
+    :str status: pending, done or failed
+    :list waypoints: top left corners of the nav cells to walk through once done (list of [float x, float y]), else None. Agents finish on their own exact goal
+    """
+    def __init__(self, key: tuple, grid: NavGrid, search: PathSearch = None, cells: list = None, status: str = 'pending'):
+        self.key = key
+        self.grid = grid
+        self.search = search
+        self.status = status
+        self.waypoints = [grid.point_of(c) for c in cells] if cells else None
+
+class Pathfinder:
+    """ Serves A* queries for every agent in the game, spread over frames by a time budget (process is called once per rendered frame).
+    Navigation grids are built per map and agent size, and results are kept in an LRU cache keyed by (map, start cell, goal cell).
+    Grids and cached paths are dropped when a map's nav_version changes (Map.set_blocks)
+    :int max_paths (input): number of paths kept in the cache (optional: default PATH_CACHE_SIZE)
+    :float budget (input): seconds of searching allowed per frame (optional: default FRAME_BUDGET)
+    :dict grids: NavGrid keyed by (map ID, agent size)
+    :OrderedDict cache: cells (or None for no path) keyed by (map ID, agent size, start cell, goal cell), least recently used first
+    :list queue: pending PathRequests, searched first come first served
+    """
+    def __init__(self, max_paths: int = PATH_CACHE_SIZE, budget: float = FRAME_BUDGET):
+        self.max_paths = max_paths
+        self.budget = budget
+        self.grids = {}
+        self.cache = OrderedDict()
+        self.queue = []
+        self.hits = 0
+        self.misses = 0
+        self.searches = 0
+
+    def get_grid(self, map, agent_size: tuple):
+        ''' get the navigation grid of a map for an agent size, rebuilding it if the map's blocks changed
+        :obj map: Map
+        :tuple agent_size: width and height of the agent
+        :return: obj NavGrid
+        '''
+        key = (map.id, tuple(agent_size))
+        grid = self.grids.get(key)
+        if grid is None or grid.version != map.nav_version:
+            if grid is not None:
+                self.invalidate(map.id)
+            mask = map.static if isinstance(map.static, Collision.CollisionMask) else None
+            grid = NavGrid(map.blocks, map.dimensions, tuple(agent_size), map.nav_version, mask)
+            self.grids[key] = grid
+        return grid
+
+    def request(self, map, start: list, goal: list, agent_size: tuple):
+        ''' queues a path from one point to another, answering at once from the cache if possible
+        :obj map: Map the agent is on
+        :list start: the agent's location (float x, float y)
+        :list goal: where the agent wants its top left corner to be (float x, float y)
+        :tuple agent_size: width and height of the agent
+        :return: obj PathRequest
+        '''
+        grid = self.get_grid(map, agent_size)
+        key = (map.id, tuple(agent_size), grid.cell_of(start), grid.cell_of(goal))
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            cells = self.cache[key]
+            return PathRequest(key, grid, cells=cells, status='done' if cells else 'failed')
+        self.misses += 1
+        for pending in self.queue:
+            if pending.key == key:
+                return pending
+        request = PathRequest(key, grid, PathSearch(grid, key[2], key[3]))
+        self.queue.append(request)
+        return request
+
+    def process(self):
+        ''' advances queued searches until the frame budget is spent. Unfinished searches resume next frame
+        :return: int searches finished
+        '''
+        finished = 0
+        deadline = time.perf_counter() + self.budget
+        while self.queue and time.perf_counter() < deadline:
+            request = self.queue[0]
+            if request.search.run(EXPANSION_CHUNK) == 'pending':
+                continue
+            self.queue.pop(0)
+            self.searches += 1
+            finished += 1
+            request.status = request.search.status
+            cells = request.search.path
+            request.waypoints = [request.grid.point_of(c) for c in cells] if cells else None
+            request.search = None
+            if self.grids.get(request.key[:2]) is request.grid:
+                self.cache[request.key] = cells
+                while len(self.cache) > self.max_paths:
+                    self.cache.popitem(last=False)
+        return finished
+
+    def invalidate(self, map_id: int):
+        ''' drops the grids, cached paths and pending searches of a map
+        :int map_id: map ID
+        :return: None
+        '''
+        self.grids = {k: g for k, g in self.grids.items() if k[0] != map_id}
+        self.cache = OrderedDict((k, p) for k, p in self.cache.items() if k[0] != map_id)
+        for request in self.queue:
+            if request.key[0] == map_id:
+                request.status = 'failed'
+        self.queue = [r for r in self.queue if r.key[0] != map_id]
+
+    def stats(self):
+        ''' reports cache and queue usage
+        :return: dict (cached, queued, hits, misses, searches)
+        '''
+        return {
+            'cached': len(self.cache),
+            'queued': len(self.queue),
+            'hits': self.hits,
+            'misses': self.misses,
+            'searches': self.searches
+        }
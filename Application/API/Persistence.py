@@ -0,0 +1,104 @@
+LOCATION = ('Location', ('LocationX', 'LocationY'))
+SIZE = ('Size', ('Width', 'Height'))
+BOUNDS = ('Bounds', ('BoundsXMin', 'BoundsXMax', 'BoundsYMin', 'BoundsYMax'))
+MOVE_RANGE = ('MoveRange', ('MoveStart', 'MoveEnd'))
+COORDINATES = ('Coordinates', ('CoordinatesX', 'CoordinatesY'))
+PC_START = ('PCStart', ('PCStartX', 'PCStartY'))
+
+def read_numbers(row, field: tuple, cast=float):
+    """ reads a coordinate, size or range from its numeric columns. Rows saved before the numeric columns existed
+    (or written by tools that only fill the text column) are read from the legacy "x, y" text column instead
+    :namedtuple row: db row
+    :tuple field: legacy text column and numeric columns, e.g. LOCATION
+    :type cast: float or int (optional: default float)
+    :return: list numbers
+    """
+    values = [getattr(row, column, None) for column in field[1]]
+    if None in values:
+        values = getattr(row, field[0]).split(', ')
+    return [cast(v) for v in values]
+
+def to_columns(column, value):
+    """ converts an attribute to the columns it is stored in. Coordinates and sizes are spread over their numeric columns and also written to
+    their legacy "x, y" text column so the two never disagree. Flags are stored as 0 or 1
+    :column: column name, or a field of a text column and its numeric columns (e.g. LOCATION)
+    :value: attribute value
+    :return: dict values keyed by column
+    """
+    if isinstance(column, tuple):
+        row = dict(zip(column[1], value))
+        row[column[0]] = ', '.join([str(v) for v in value])
+        return row
+    if isinstance(value, bool):
+        return {column: 1 if value else 0}
+    return {column: value}
+
+def frozen(value):
+    """ copies an attribute value for comparing it later. Lists (locations, inventories) are copied to tuples, so changing one in place still shows
+    :value: attribute value
+    :return: value, or tuple for a list
+    """
+    return tuple(value) if isinstance(value, list) else value
+
+class Persisted:
+    """ Mixin for entities saved to the database. The persisted attributes are plain attributes; a game's DirtySet keeps a copy of them as last saved
+    and compares against it when the game is saved, so a save only writes the rows (and columns) that changed
+    :str table: table the entity is saved to (class attribute)
+    :dict persisted: column (or field of text and numeric columns, e.g. LOCATION) of each persisted attribute, or None for one saved elsewhere (e.g. inventory) (class attribute)
+    """
+    table = None
+    persisted = {}
+
+    def snapshot(self):
+        """ copies the persisted attributes
+        :return: dict values keyed by attribute name
+        """
+        return {name: frozen(getattr(self, name)) for name in self.persisted}
+
+class DirtySet:
+    """ Entities of a game with the persisted attributes they had when last saved (or loaded). pop compares them with their current values,
+    so nothing is tracked while the game runs and every change is found however it was made
+    :dict saved: snapshot of the persisted attributes keyed by entity (see Persisted.snapshot)
+    :dict changed: set of attribute names keyed by entity, put back by merge after a failed save
+    """
+    def __init__(self):
+        self.saved = {}
+        self.changed = {}
+
+    def __len__(self):
+        return len(self.saved)
+
+    def attach(self, entities: list):
+        """ starts tracking entities. Their current state is taken as saved. Entities already tracked keep their snapshot,
+        so changes made before a map was left and entered again are not lost
+        :list entities: Persisted entities (e.g. a map's items, creatures and monsters)
+        :return: None
+        """
+        for entity in entities:
+            if entity not in self.saved:
+                self.saved[entity] = entity.snapshot()
+
+    def mark(self, entity, name: str):
+        self.changed.setdefault(entity, set()).add(name)
+
+    def pop(self):
+        """ takes every change made since the last pop, taking the current state as saved
+        :return: dict set of attribute names keyed by entity
+        """
+        changed = self.changed
+        self.changed = {}
+        for entity, saved in self.saved.items():
+            for name, value in saved.items():
+                current = frozen(getattr(entity, name))
+                if current != value:
+                    saved[name] = current
+                    changed.setdefault(entity, set()).add(name)
+        return changed
+
+    def merge(self, changed: dict):
+        """ puts changes back (e.g. after a save that failed)
+        :dict changed: set of attribute names keyed by entity
+        :return: None
+        """
+        for entity, names in changed.items():
+            self.changed.setdefault(entity, set()).update(names)
@@ -0,0 +1,108 @@
+import os
+import queue
+import threading
+from . import DBManager, MapImage
+
+MAP_TABLES = ['Items', 'Blocks', 'NPCs', 'Monsters', 'Portals']
+
+class MapPrefetcher:
+    """ Warms maps on a background thread (image decode/tile cache and db rows) so portal transitions don't stall the frame loop.
+    The worker uses its own db connection and never converts surfaces, which is left to the main thread
+    :str db_file (input): filepath to the game database
+    :str directory (input): the game directory
+    :int max_ready (input): maximum number of finished bundles to hold, oldest are dropped first (optional: default 2)
+    :dict ready: finished bundles keyed by map ID (None if the prefetch failed and the map must be loaded synchronously)
+    :set pending: IDs of maps queued or being prefetched
+    """
+    def __init__(self, db_file: str, directory: str, max_ready: int = 2):
+        self.db_file = db_file
+        self.directory = directory
+        self.max_ready = max_ready
+        self.requests = queue.Queue()
+        self.ready = {}
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+        self.thread = None
+
+    def request(self, map_id: int, image: str, type: str, image_only: bool = False):
+        """ queues a map to be warmed on the worker thread
+        :int map_id: map ID
+        :str image: the filename of the main map image
+        :str type: the type of map (static, dynamic, sidescroll)
+        :bool image_only: whether the map is already built and only its image is needed (optional: default False)
+        :return: None
+        """
+        with self.lock:
+            if map_id in self.pending or map_id in self.ready:
+                return
+            self.pending.add(map_id)
+        self.requests.put((map_id, image, type, image_only))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='MapPrefetcher', daemon=True)
+            self.thread.start()
+
+    def is_pending(self, map_id: int):
+        with self.lock:
+            return map_id in self.pending
+
+    def wait(self, map_id: int):
+        """ blocks until a queued map has finished prefetching
+        :int map_id: map ID
+        :return: None
+        """
+        with self.done:
+            while map_id in self.pending:
+                self.done.wait()
+
+    def take(self, map_id: int):
+        """ hands a finished bundle to the main thread
+        :int map_id: map ID
+        :return: dict bundle (image, rows, item_types) or None if nothing was prefetched
+        """
+        with self.lock:
+            return self.ready.pop(map_id, None)
+
+    def clear(self):
+        """ forgets finished bundles (e.g. when another game is loaded)
+        :return: None
+        """
+        with self.lock:
+            self.ready = {}
+
+    def run(self):
+        """ worker loop: prefetches queued maps one at a time
+        :return: None
+        """
+        dbconn = DBManager.DBManager(self.db_file)
+        while True:
+            map_id, image, type, image_only = self.requests.get()
+            try:
+                bundle = self.prefetch(dbconn, map_id, image, type, image_only)
+            except Exception as e:
+                print(e)
+                bundle = None
+            with self.lock:
+                self.ready[map_id] = bundle
+                self.pending.discard(map_id)
+                while len(self.ready) > self.max_ready:
+                    self.ready.pop(next(iter(self.ready)))
+                self.done.notify_all()
+
+    def prefetch(self, dbconn, map_id: int, image: str, type: str, image_only: bool):
+        """ reads everything needed to build a map
+        :obj dbconn: worker db connection object
+        :int map_id: map ID
+        :str image: the filename of the main map image
+        :str type: the type of map (static, dynamic, sidescroll)
+        :bool image_only: whether to skip the db rows
+        :return: dict bundle
+        """
+        bundle = {
+            'image': MapImage.preload_image(os.path.join(self.directory, f'Resources/{image}'), os.path.join(self.directory, 'Cache/MapTiles'), type)
+        }
+        if not image_only:
+            bundle['rows'] = {table: dbconn.get_associated_items(table, 'MapID', map_id) for table in MAP_TABLES}
+            type_ids = set(i[6] for i in bundle['rows']['Items'])
+            bundle['item_types'] = {t: dbconn.get_row_by_id('ItemTypes', t) for t in type_ids}
+        return bundle
@@ -0,0 +1,103 @@
+import pygame
+import json
+import time
+
+OVERLAY_INTERVAL = 30
+
+class FrameProfiler:
+    """ Times each phase of a frame into fixed-size ring buffers and reports rolling percentiles
+    :int size (input): number of frames kept per phase (optional: default 600)
+    :dict samples: ring buffer of phase durations in seconds keyed by phase name
+    :int frames: number of frames recorded so far
+    """
+    def __init__(self, size: int = 600):
+        self.size = size
+        self.samples = {}
+        self.frames = 0
+        self.current = {}
+        self.last = time.perf_counter()
+        self.font = None
+        self.panel = None
+        self.panel_frame = 0
+
+    def begin_frame(self):
+        """ starts timing a new frame
+        :return: None
+        """
+        self.current = {}
+        self.last = time.perf_counter()
+
+    def mark(self, phase: str):
+        """ charges the time since the previous mark to a phase
+        :str phase: phase name
+        :return: None
+        """
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0) + now - self.last
+        self.last = now
+
+    def end_frame(self):
+        """ stores the frame's phase times (and their total) in the ring buffers
+        :return: None
+        """
+        self.current['frame'] = sum(self.current.values())
+        index = self.frames % self.size
+        for phase, elapsed in self.current.items():
+            ring = self.samples.get(phase)
+            if ring is None:
+                ring = [0.0] * self.size
+                self.samples[phase] = ring
+            ring[index] = elapsed
+        for phase, ring in self.samples.items():
+            if phase not in self.current:
+                ring[index] = 0.0
+        self.frames += 1
+
+    def percentiles(self):
+        """ rolling p50/p95/p99 of every phase over the buffered frames
+        :return: dict phase -> dict (p50, p95, p99) in milliseconds
+        """
+        count = min(self.frames, self.size)
+        report = {}
+        for phase, ring in self.samples.items():
+            values = sorted(ring[:count])
+            if not values:
+                continue
+            report[phase] = {
+                'p50': values[int(0.50 * (count - 1))] * 1000,
+                'p95': values[int(0.95 * (count - 1))] * 1000,
+                'p99': values[int(0.99 * (count - 1))] * 1000
+            }
+        return report
+
+    def dump_json(self, path: str):
+        """ writes the current percentiles to a json file
+        :str path: output filepath
+        :return: dict report
+        """
+        report = {
+            'frames': self.frames,
+            'window': min(self.frames, self.size),
+            'phases_ms': self.percentiles()
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    def overlay(self):
+        """ renders the percentiles as a text panel, rebuilt at most every OVERLAY_INTERVAL frames
+        :return: pygame Surface
+        """
+        if self.panel is None or self.frames - self.panel_frame >= OVERLAY_INTERVAL:
+            if self.font is None:
+                pygame.font.init()
+                self.font = pygame.font.Font(None, 20)
+            lines = [f'{phase:>10} p50 {p["p50"]:6.2f}  p95 {p["p95"]:6.2f}  p99 {p["p99"]:6.2f} ms' for phase, p in self.percentiles().items()]
+            rendered = [self.font.render(line, True, (255, 255, 255)) for line in lines] or [self.font.render('no frames yet', True, (255, 255, 255))]
+            self.panel = pygame.Surface((max(r.get_width() for r in rendered) + 10, 16 * len(rendered) + 10))
+            y = 5
+            for r in rendered:
+                self.panel.blit(r, (5, y))
+                y += 16
+            self.panel_frame = self.frames
+        return self.panel
@@ -0,0 +1,142 @@
+import pygame
+
+class DirtyRectRenderer:
+    """ Optional renderer that only repaints and presents the parts of the screen that changed since the last frame
+    :tuple screen_size (input): current screen size (int x, int y)
+    :dict previous: tracked rects and signatures from the last presented frame (key: (pygame Rect, signature))
+    :dict current: tracked rects and signatures for the frame being built
+    :dict watched: last seen value of every watched piece of view state (camera, veil, map id)
+    :list dirty: screen rects that need to be repainted this frame
+    :bool full: whether the whole screen needs to be repainted this frame
+    :int last_rect_count: number of rects presented on the last frame (0 for an idle frame, -1 for a full repaint)
+    """
+    def __init__(self, screen_size: tuple):
+        self.screen_size = screen_size
+        self.previous = {}
+        self.current = {}
+        self.watched = {}
+        self.dirty = []
+        self.full = True
+        self.last_rect_count = -1
+
+    def resize(self, screen_size: tuple):
+        """ sets a new screen size and schedules a full repaint
+        :tuple screen_size: new screen size (int x, int y)
+        :return: None
+        """
+        self.screen_size = screen_size
+        self.invalidate()
+
+    def invalidate(self):
+        """ schedules a full repaint for the next present
+        :return: None
+        """
+        self.full = True
+
+    def watch(self, key, value):
+        """ schedules a full repaint when a piece of whole-screen state changes (e.g. the camera offset or veil alpha)
+        :key: any hashable name for the state
+        :value: current value of the state (compared with ==)
+        :return: None
+        """
+        if self.watched.get(key, None) != value:
+            self.watched[key] = value
+            self.full = True
+
+    def track(self, key, location, size, signature=None):
+        """ records where a drawable is on screen this frame. Its old and new rects are marked dirty if it moved, changed size, or its signature (e.g. current icon) changed
+        :key: any hashable unique to the drawable
+        :list location: screen coordinates of the top left corner (float x, float y)
+        :tuple size: size of the drawn area (int width, int height)
+        :signature: anything that changes when the drawable needs repainting in place (optional: default None)
+        :return: None
+        """
+        rect = pygame.Rect(int(location[0]), int(location[1]), int(size[0]) + 1, int(size[1]) + 1)
+        entry = (rect, signature)
+        self.current[key] = entry
+        prev = self.previous.get(key)
+        if prev != entry:
+            if prev is not None:
+                self.dirty.append(prev[0])
+            self.dirty.append(rect)
+
+    def present(self, screen, draw):
+        """ repaints and presents the dirty regions of the screen
+        :object screen: main game screen
+        :function draw: callable that paints the full scene onto the screen (clipped to each dirty rect)
+        :return: int number of presented rects (0 if idle, -1 on a full repaint)
+        """
+        for key, entry in self.previous.items():
+            if key not in self.current:
+                self.dirty.append(entry[0])
+        self.previous = self.current
+        self.current = {}
+        screen_rect = pygame.Rect(0, 0, self.screen_size[0], self.screen_size[1])
+        rects = [r.clip(screen_rect) for r in self.dirty]
+        rects = [r for r in rects if r.width > 0 and r.height > 0]
+        self.dirty = []
+        if not self.full and rects and sum(r.width * r.height for r in rects) > screen_rect.width * screen_rect.height // 2:
+            self.full = True
+        if self.full:
+            self.full = False
+            draw()
+            pygame.display.update()
+            self.last_rect_count = -1
+            return self.last_rect_count
+        for r in rects:
+            screen.set_clip(r)
+            draw()
+        screen.set_clip(None)
+        if rects:
+            pygame.display.update(rects)
+        self.last_rect_count = len(rects)
+        return self.last_rect_count
+
+class OverlayCache:
+    """ Keeps the pristine UI overlay images and one smoothscaled copy of each per screen size, plus the composed inventory panel
+    :dict sources (input): unscaled overlay images keyed by name (e.g. dialog, inventory)
+    :dict scaled: scaled overlays keyed by name (value: (tuple size, pygame Surface))
+    :tuple panel_key: screen size and inventory contents the cached inventory panel was composed for
+    :object panel: composed inventory panel (scaled inventory image with item icons), or None
+    """
+    def __init__(self, sources: dict):
+        self.sources = sources
+        self.scaled = {}
+        self.panel_key = None
+        self.panel = None
+
+    def invalidate(self):
+        """ drops every scaled copy (on VIDEORESIZE/change_screen)
+        :return: None
+        """
+        self.scaled = {}
+        self.panel_key = None
+        self.panel = None
+
+    def get(self, name: str, size: tuple):
+        """ returns an overlay scaled to a size, resampling the pristine image only when the size changes
+        :str name: overlay name
+        :tuple size: size to draw the overlay at (int width, int height)
+        :return: pygame Surface
+        """
+        cached = self.scaled.get(name)
+        if cached is None or cached[0] != size:
+            cached = (size, pygame.transform.smoothscale(self.sources[name], size))
+            self.scaled[name] = cached
+        return cached[1]
+
+    def inventory_panel(self, size: tuple, inventory: list):
+        """ returns the inventory overlay with the icons of every inventoried item, composing it only when the inventory or size changes
+        :tuple size: size to draw the inventory at (int width, int height)
+        :list inventory: inventoried items
+        :return: pygame Surface
+        """
+        key = (size, tuple(id(item) for item in inventory))
+        if key != self.panel_key:
+            self.panel = self.get('inventory', size).copy()
+            inv_x = 30
+            for item in inventory:
+                self.panel.blit(item.inv_icon, (inv_x, 30))
+                inv_x += size[0] / 9
+            self.panel_key = key
+        return self.panel
@@ -0,0 +1,195 @@
+import heapq
+import math
+
+CELL_SIZE = 128
+
+class SpatialHash:
+    """ Uniform grid over world coordinates. Answers "what overlaps this rect" by visiting only the cells the rect touches
+    :int cell_size (input): width and height of a grid cell in pixels (optional: default CELL_SIZE)
+    :dict cells: objects in each cell keyed by (column, row)
+    :dict entries: cell keys and insertion order of every indexed object, keyed by object
+    """
+    def __init__(self, cell_size: int = CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = {}
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, obj):
+        return obj in self.entries
+
+    def cell_keys(self, x: float, y: float, w: float, h: float):
+        ''' get the keys of every cell a rect touches
+        :float x: left edge
+        :float y: top edge
+        :float w: width
+        :float h: height
+        :return: tuple of (column, row)
+        '''
+        size = self.cell_size
+        first_col = int(x // size)
+        last_col = int((x + w) // size)
+        first_row = int(y // size)
+        last_row = int((y + h) // size)
+        return tuple((col, row) for col in range(first_col, last_col + 1) for row in range(first_row, last_row + 1))
+
+    def insert(self, obj):
+        ''' adds an object with a location and size to the index
+        :obj obj: object to index (e.g. Item, Block, NPC, Portal)
+        :return: None
+        '''
+        keys = self.cell_keys(obj.location[0], obj.location[1], obj.size[0], obj.size[1])
+        for key in keys:
+            self.cells.setdefault(key, []).append(obj)
+        self.entries[obj] = (keys, self.counter)
+        self.counter += 1
+
+    def remove(self, obj):
+        ''' removes an object from the index (e.g. an item that was picked up)
+        :obj obj: indexed object
+        :return: None
+        '''
+        entry = self.entries.pop(obj, None)
+        if entry is None:
+            return
+        for key in entry[0]:
+            cell = self.cells[key]
+            cell.remove(obj)
+            if not cell:
+                del self.cells[key]
+
+    def update(self, obj):
+        ''' moves an object to the cells under its current location. Cheap when it hasn't left its cells
+        :obj obj: indexed object
+        :return: None
+        '''
+        entry = self.entries.get(obj)
+        if entry is None:
+            self.insert(obj)
+            return
+        keys = self.cell_keys(obj.location[0], obj.location[1], obj.size[0], obj.size[1])
+        if keys == entry[0]:
+            return
+        for key in entry[0]:
+            cell = self.cells[key]
+            cell.remove(obj)
+            if not cell:
+                del self.cells[key]
+        for key in keys:
+            self.cells.setdefault(key, []).append(obj)
+        self.entries[obj] = (keys, entry[1])
+
+    def query(self, x: float, y: float, w: float, h: float):
+        ''' get every indexed object overlapping a rect, in insertion order
+        :float x: left edge
+        :float y: top edge
+        :float w: width
+        :float h: height
+        :return: list objects
+        '''
+        found = {}
+        for key in self.cell_keys(x, y, w, h):
+            for obj in self.cells.get(key, ()):
+                if obj not in found and obj.location[0] <= x + w and x <= obj.location[0] + obj.size[0] and obj.location[1] <= y + h and y <= obj.location[1] + obj.size[1]:
+                    found[obj] = self.entries[obj][1]
+        return sorted(found, key=found.get)
+
+    def at(self, point: tuple):
+        ''' get the indexed objects whose rect strictly contains a point (e.g. a click), in insertion order. Only the point's cell is visited
+        :tuple point: world coordinates (float x, float y)
+        :return: list objects
+        '''
+        x, y = point
+        found = [obj for obj in self.cells.get((int(x // self.cell_size), int(y // self.cell_size)), ())
+                    if obj.location[0] < x < obj.location[0] + obj.size[0] and obj.location[1] < y < obj.location[1] + obj.size[1]]
+        found.sort(key=lambda obj: self.entries[obj][1])
+        return found
+
+    def nearest(self, location: list, size: tuple, radius: float, accept=None):
+        ''' get the indexed objects within a distance of a rect, nearest first. Only the cells within the radius are visited
+        :list location: world coordinates of the top left corner (float x, float y)
+        :tuple size: width and height of the rect (0, 0 for a point)
+        :float radius: largest gap between the rect and an object
+        :function accept: filter called with each object (optional: default None, everything is accepted)
+        :return: list of tuple (float distance, object), nearest first and in insertion order on ties
+        '''
+        found = []
+        for obj in self.query(location[0] - radius, location[1] - radius, size[0] + radius * 2, size[1] + radius * 2):
+            if accept is not None and not accept(obj):
+                continue
+            dx = max(obj.location[0] - (location[0] + size[0]), location[0] - (obj.location[0] + obj.size[0]), 0)
+            dy = max(obj.location[1] - (location[1] + size[1]), location[1] - (obj.location[1] + obj.size[1]), 0)
+            distance = math.hypot(dx, dy)
+            if distance <= radius:
+                found.append((distance, obj))
+        found.sort(key=lambda f: f[0])
+        return found
+
+class SweepAndPrune:
+    """ Sort-and-sweep broadphase over moving bodies (creatures, monsters and the pc). Bodies are kept sorted by their left edge between ticks,
+    so re-sorting is close to linear while they move a little each frame. Each box is grown by its body's speed to cover this tick's movement.
+    The sweep keeps its open boxes in horizontal bands of band_size pixels, each a heap ordered by right edge, so a body is only tested against
+    the open boxes in the bands it spans and closed boxes are dropped from the front
+    :int band_size (input): height of a band in pixels (optional: default CELL_SIZE)
+    :list order: bodies sorted by left edge
+    :list pairs: candidate pairs found by the last update (tuple body, body)
+    :list links: the same pairs as positions in order (tuple int, int), for array consumers such as NPCBatch
+    :dict neighbours: bodies each body may touch this tick, keyed by body
+    """
+    def __init__(self, band_size: int = CELL_SIZE):
+        self.band_size = band_size
+        self.order = []
+        self.pairs = []
+        self.links = []
+        self.neighbours = {}
+
+    def update(self, bodies: list):
+        ''' re-sorts the bodies and finds every pair whose grown boxes overlap
+        :list bodies: anything with a location, size and speed
+        :return: int number of candidate pairs
+        '''
+        current = dict.fromkeys(bodies)
+        order = [b for b in self.order if b in current]
+        known = set(order)
+        order += [b for b in current if b not in known]
+        order.sort(key=lambda b: b.location[0] - abs(b.speed))
+        self.order = order
+        self.pairs = pairs = []
+        self.links = links = []
+        self.neighbours = neighbours = {b: [] for b in order}
+        size = self.band_size
+        bands = {}
+        for counter, body in enumerate(order):
+            margin = abs(body.speed)
+            left = body.location[0] - margin
+            right = body.location[0] + body.size[0] + margin
+            top = body.location[1] - margin
+            bottom = body.location[1] + body.size[1] + margin
+            first = int(top // size)
+            entry = (right, counter, body, top, bottom, first)
+            for band in range(first, int(bottom // size) + 1):
+                open_boxes = bands.get(band)
+                if open_boxes is None:
+                    bands[band] = [entry]
+                    continue
+                while open_boxes and open_boxes[0][0] < left:
+                    heapq.heappop(open_boxes)
+                for a_right, a_counter, a, a_top, a_bottom, a_first in open_boxes:
+                    # a pair sharing several bands is only reported in the first of them
+                    if a_top <= bottom and top <= a_bottom and max(first, a_first) == band:
+                        pairs.append((a, body))
+                        links.append((a_counter, counter))
+                        neighbours[a].append(body)
+                        neighbours[body].append(a)
+                heapq.heappush(open_boxes, entry)
+        return len(pairs)
+
+    def get_neighbours(self, body):
+        ''' get the bodies that may touch a body this tick
+        :obj body: a body passed to the last update
+        :return: list bodies
+        '''
+        return self.neighbours.get(body, [])
@@ -0,0 +1,72 @@
+import pygame
+import os
+
+class SpriteCache:
+    """ Process-wide registry of decoded sprite surfaces, shared between every Creature and Item instance
+    :dict surfaces: loaded surfaces keyed by (resolved filepath, conversion mode)
+    :int hits: number of loads answered from the registry
+    :int misses: number of loads that had to decode the file from disk
+    :return: None
+    """
+    MODES = ('alpha', 'opaque', 'raw')
+
+    def __init__(self):
+        self.surfaces = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path: str, mode: str = 'alpha'):
+        """ returns the surface for a filepath, decoding and converting it only the first time it is requested
+        :str path: filepath to the image
+        :str mode: conversion mode (alpha = convert_alpha, opaque = convert, raw = no conversion)(optional: default alpha)
+        :return: pygame Surface (shared, do not draw onto it)
+        """
+        if mode not in self.MODES:
+            raise ValueError(f'unknown sprite conversion mode: {mode}')
+        key = (os.path.realpath(path), mode)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = pygame.image.load(key[0])
+        if mode == 'alpha':
+            surface = surface.convert_alpha()
+        elif mode == 'opaque':
+            surface = surface.convert()
+        self.surfaces[key] = surface
+        return surface
+
+    def load_frames(self, directory: str, prefix: str, mode: str = 'alpha'):
+        """ loads a 4-frame walk/idle cycle ({prefix}1, 2, 3, 2). The repeated middle frame is the same Surface object
+        :str directory: the game directory
+        :str prefix: sprite name and suffix (e.g. flipsn) without frame number
+        :str mode: conversion mode (optional: default alpha)
+        :return: list of surfaces
+        """
+        frames = [self.load(os.path.join(directory, f'Resources/{prefix}{i}.png'), mode) for i in (1, 2, 3)]
+        return [frames[0], frames[1], frames[2], frames[1]]
+
+    def stats(self):
+        """ reports registry usage
+        :return: dict (hits, misses, surfaces, bytes)
+        """
+        held = 0
+        for surface in self.surfaces.values():
+            held += surface.get_pitch() * surface.get_height()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'surfaces': len(self.surfaces),
+            'bytes': held
+        }
+
+    def clear(self):
+        """ drops every cached surface and resets the counters (e.g. after the display mode changes pixel format)
+        :return: None
+        """
+        self.surfaces = {}
+        self.hits = 0
+        self.misses = 0
+
+sprites = SpriteCache()
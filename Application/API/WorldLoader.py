@@ -0,0 +1,33 @@
+from . import Prefetcher
+
+class WorldLoader:
+    """ Reads everything on a game's maps in a handful of set-based queries (one per table, items joined with their ItemTypes) and splits the rows by map,
+    so the number of queries doesn't grow with the number of maps or entities. ItemTypes are read once and kept in memory
+    :obj dbconn (input): main game db connection object
+    :dict item_types: ItemTypes rows keyed by ID, or None until first needed
+    """
+    def __init__(self, dbconn):
+        self.dbconn = dbconn
+        self.item_types = None
+
+    def get_item_types(self):
+        ''' get every ItemTypes row, reading the table on first use
+        :return: dict rows keyed by item type ID
+        '''
+        if self.item_types is None:
+            self.item_types = {t[0]: t for t in self.dbconn.get_all_rows('ItemTypes')}
+        return self.item_types
+
+    def load_game(self, game_id: int, map_ids: list):
+        ''' reads the items, blocks, NPCs, monsters and portals of every map of a game
+        :int game_id: game ID
+        :list map_ids: IDs of the game's maps
+        :return: dict bundle (rows, item_types) keyed by map ID, in the shape the map prefetcher produces
+        '''
+        item_types = self.get_item_types()
+        bundles = {m: {'rows': {table: [] for table in Prefetcher.MAP_TABLES}, 'item_types': item_types} for m in map_ids}
+        for table in Prefetcher.MAP_TABLES:
+            rows = self.dbconn.get_game_items(game_id) if table == 'Items' else self.dbconn.get_game_rows(table, game_id)
+            for row in rows:
+                bundles[row[1]]['rows'][table].append(row)
+        return bundles
@@ -0,0 +1,58 @@
+'''
+Name: Collision_Benchmark.py
+Purpose: to time Collision.sweep over a plain blocker list against the numpy and spatial hash collision backends with 10, 1k and 100k blockers
+Author: Phil Elder
+Creation Date: 20261018
+'''
+
+import sys
+import os
+import random
+import time
+helper_path = f'{os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}/Application'
+sys.path.insert(1, helper_path)
+from API import Collision, SpatialIndex
+
+COUNTS = [10, 1000, 100000]
+QUERIES = 50
+WORLD_SIZE = 20000
+PC_SIZE = (64, 64)
+SPEED = 6.5
+VELOCITIES = [(SPEED, 0), (0 - SPEED, 0), (0, SPEED), (0, 0 - SPEED), (SPEED, SPEED), (0 - SPEED, 0 - SPEED)]
+
+class Box:
+    def __init__(self, location: list, size: tuple):
+        self.location = location
+        self.size = size
+
+def time_queries(pc: Box, queries: list, sweep):
+    ''' runs a sweep along every test velocity from every query location
+    :obj pc: the moving rect
+    :list queries: pc locations
+    :function sweep: callable taking (velocity)
+    :return: float microseconds per sweep
+    '''
+    start = time.perf_counter()
+    for q in queries:
+        pc.location = q
+        for v in VELOCITIES:
+            sweep(v)
+    return (time.perf_counter() - start) / (len(queries) * len(VELOCITIES)) * 1000000
+
+random.seed(0)
+print(f"{'blockers':>10} {'loop us':>10} {'numpy us':>10} {'hash us':>10}")
+for count in COUNTS:
+    blockers = [Box([random.uniform(0, WORLD_SIZE), random.uniform(0, WORLD_SIZE)], (random.randint(10, 200), random.randint(10, 200))) for _ in range(count)]
+    queries = [[random.uniform(0, WORLD_SIZE), random.uniform(0, WORLD_SIZE)] for _ in range(QUERIES)]
+    pc = Box([0, 0], PC_SIZE)
+    loop = time_queries(pc, queries, lambda v: Collision.sweep(pc.location, pc.size, v, blockers))
+    if Collision.BlockerArrays.available():
+        arrays = Collision.BlockerArrays(blockers)
+        vector = f'{time_queries(pc, queries, lambda v: Collision.sweep(pc.location, pc.size, v, [], arrays)):10.1f}'
+    else:
+        vector = f"{'no numpy':>10}"
+    spatial = SpatialIndex.SpatialHash()
+    for b in blockers:
+        spatial.insert(b)
+    hashed = time_queries(pc, queries, lambda v: Collision.sweep(pc.location, pc.size, v, spatial.query(pc.location[0] - SPEED, pc.location[1] - SPEED, pc.size[0] + SPEED * 2, pc.size[1] + SPEED * 2)))
+    print(f'{count:>10} {loop:10.1f} {vector} {hashed:10.1f}')
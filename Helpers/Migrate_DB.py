@@ -0,0 +1,31 @@
+'''
+Name: Migrate_DB.py
+Purpose: to bring game save databases up to the current schema version (defaults to main.db), or report their versions with --check. The shipped template.db is left as is unless named
+Author: Phil Elder
+Creation Date: 20261018
+'''
+
+import sys
+import os
+helper_path = f'{os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}/Application'
+sys.path.insert(1, helper_path)
+from API import DBManager, Migrations
+
+args = [a for a in sys.argv[1:] if a != '--check']
+check_only = '--check' in sys.argv[1:]
+files = args if args else [f'{helper_path}/Database/main.db']
+
+for file in files:
+    if not os.path.exists(file):
+        print(f'{file}: not found')
+        continue
+    db = DBManager.DBManager(file)
+    version = db.get_user_version()
+    if check_only:
+        print(f'{file}: version {version} of {Migrations.SCHEMA_VERSION}')
+        continue
+    applied = Migrations.migrate(db)
+    if applied:
+        print(f'{file}: migrated from version {version} to {applied[-1]}')
+    else:
+        print(f'{file}: already at version {version}')